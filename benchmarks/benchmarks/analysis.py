@@ -0,0 +1,43 @@
+"""
+Benchmarks for the cross-section tools in earthsim.analysis.
+"""
+
+import numpy as np
+
+from shapely.geometry import LineString
+
+from earthsim.analysis import interpolate_line
+
+
+def interpolate_line_legacy(geom, distance):
+    """
+    The per-sample shapely interpolation interpolate_line replaced.
+    """
+    xs, ys = [], []
+    for d in distance:
+        point = geom.interpolate(d)
+        xs.append(point.x)
+        ys.append(point.y)
+    return xs, ys
+
+
+class InterpolateLine(object):
+    """
+    Resamples a 100 km transect with 50 vertices.
+    """
+
+    params = [1000, 100, 10]
+    param_names = ['resolution']
+
+    def setup(self, resolution):
+        xs = np.linspace(0, 100000/np.sqrt(2), 50)
+        ys = xs + np.sin(np.arange(50))
+        self.geom = LineString(np.column_stack([xs, ys]))
+        dist = self.geom.length
+        self.distance = np.linspace(0, dist, int(dist/resolution))
+
+    def time_interpolate_line(self, resolution):
+        interpolate_line([np.asarray(self.geom.coords)], self.distance)
+
+    def time_interpolate_line_legacy(self, resolution):
+        interpolate_line_legacy(self.geom, self.distance)
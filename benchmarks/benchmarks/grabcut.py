@@ -0,0 +1,83 @@
+"""
+Benchmarks for the GrabCut mask utilities in earthsim.grabcut.
+"""
+
+import numpy as np
+
+from PIL import Image, ImageDraw
+
+from earthsim.grabcut import StrokeMaskCache, _fill_polygons
+
+
+def fill_polygons_legacy(polygons, shape):
+    """
+    The per-polygon PIL drawing _fill_polygons replaced.
+    """
+    height, width = shape
+    img = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(img)
+    for rings in polygons:
+        xs, ys = rings[0].T
+        draw.polygon(list(zip(xs, ys)), outline=1, fill=1)
+    return np.array(img).astype('bool')
+
+
+def freehand_polygons(n, size, vertices=400, seed=0):
+    """
+    Returns n wobbly closed strokes with the given number of vertices
+    scattered over a size by size pixel grid.
+    """
+    rs = np.random.RandomState(seed)
+    t = np.linspace(0, 2*np.pi, vertices)
+    polygons = []
+    for _ in range(n):
+        (cx, cy), r = rs.uniform(0, size, 2), rs.uniform(size/20., size/5.)
+        r = r * (1 + 0.2*np.sin(5*t))
+        polygons.append([np.column_stack([cx + r*np.cos(t), cy + r*np.sin(t)])])
+    return polygons
+
+
+class FillPolygons(object):
+    """
+    Rasterizes freehand strokes onto a square grid.
+    """
+
+    params = [[10, 200], [1000, 4000]]
+    param_names = ['strokes', 'size']
+
+    def setup(self, n, size):
+        self.polygons = freehand_polygons(n, size)
+
+    def time_fill_polygons(self, n, size):
+        _fill_polygons(self.polygons, (size, size))
+
+    def time_fill_polygons_legacy(self, n, size):
+        fill_polygons_legacy(self.polygons, (size, size))
+
+
+class AddStroke(object):
+    """
+    Updates the mask of a set of freehand strokes after one more
+    stroke is drawn.
+    """
+
+    params = [[10, 200], [1000, 4000]]
+    param_names = ['strokes', 'size']
+
+    def setup(self, n, size):
+        polygons = freehand_polygons(n+1, size)
+        self.strokes = [(str(i), p[0]) for i, p in enumerate(polygons)]
+        self.shape = (size, size)
+        self.cache = StrokeMaskCache()
+        self.cache.mask('foreground', None, self.shape, self.strokes[:-1], self.rasterize)
+
+    def rasterize(self, strokes):
+        return _fill_polygons([[s] for s in strokes], self.shape)
+
+    def time_add_stroke_cached(self, n, size):
+        cache = StrokeMaskCache()
+        cache._masks.update(self.cache._masks)
+        cache.mask('foreground', None, self.shape, self.strokes, self.rasterize)
+
+    def time_add_stroke_uncached(self, n, size):
+        self.rasterize([s for _, s in self.strokes])
@@ -0,0 +1,66 @@
+"""
+Benchmarks for the mesh utilities in earthsim.mesh.
+"""
+
+import numpy as np
+import pandas as pd
+
+from earthsim.mesh import TriangleIndex, renumber_mesh
+
+from .mesh_io import grid_mesh
+
+
+def shuffled_mesh(n, seed=1):
+    """
+    Returns a triangulated grid with randomly ordered nodes and
+    elements, emulating the poor locality of mesher output.
+    """
+    tris, verts = grid_mesh(n, n)
+    rs = np.random.RandomState(seed)
+    perm = rs.permutation(len(verts))
+    inverse = np.argsort(perm)
+    tris = inverse[tris][rs.permutation(len(tris))]
+    return tris, verts[perm]
+
+
+class RenumberMesh(object):
+
+    params = [[300, 1000], ['rcm', 'hilbert']]
+    param_names = ['nodes_per_side', 'method']
+
+    def setup(self, n, method):
+        self.tris, self.verts = shuffled_mesh(n)
+
+    def time_renumber_mesh(self, n, method):
+        renumber_mesh(self.tris, self.verts, method=method)
+
+
+class RenumberedSampling(object):
+    """
+    Compares gathering node values by element on a mesh with shuffled
+    nodes against the same mesh after renumbering.
+    """
+
+    params = [[300, 1000], ['shuffled', 'rcm', 'hilbert']]
+    param_names = ['nodes_per_side', 'ordering']
+
+    def setup(self, n, ordering):
+        tris, verts = shuffled_mesh(n)
+        if ordering != 'shuffled':
+            tris, verts, _ = renumber_mesh(tris, verts, method=ordering)
+        self.tris, self.verts = tris, verts
+        self.values = verts[:, 0] + verts[:, 1]
+        self.index = TriangleIndex(verts, tris)
+        rs = np.random.RandomState(2)
+        self.xs, self.ys = rs.rand(2, 10**6)*(n-1)
+
+    def time_cross_section_sampling(self, n, ordering):
+        self.index.interpolate(self.values, self.xs, self.ys)
+
+    def time_trimesh_rasterize(self, n, ordering):
+        import holoviews as hv
+        from holoviews.operation.datashader import rasterize
+        nodes = hv.Points(pd.DataFrame(np.column_stack([self.verts[:, :2], self.values]),
+                                       columns=['x', 'y', 'z']), vdims=['z'])
+        trimesh = hv.TriMesh((self.tris, nodes))
+        rasterize(trimesh, width=800, height=800, dynamic=False)
@@ -0,0 +1,94 @@
+"""
+Benchmarks for reading and writing mesh file formats.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from earthsim.io import read_3dm_mesh, write_3dm_mesh
+
+
+def grid_mesh(nx, ny):
+    """
+    Triangulates a regular grid of nx by ny nodes returning the
+    connectivity and vertex arrays.
+    """
+    xs, ys = np.meshgrid(np.arange(nx, dtype=float), np.arange(ny, dtype=float))
+    verts = np.column_stack([xs.ravel(), ys.ravel(), np.zeros(nx*ny)])
+    idx = np.arange(nx*ny).reshape(ny, nx)
+    v0, v1, v2, v3 = idx[:-1, :-1], idx[:-1, 1:], idx[1:, 1:], idx[1:, :-1]
+    tris = np.concatenate([np.column_stack([v0.ravel(), v1.ravel(), v2.ravel()]),
+                           np.column_stack([v0.ravel(), v2.ravel(), v3.ravel()])])
+    return tris, verts
+
+
+def write_3dm(path, tris, verts):
+    with open(path, 'w') as f:
+        f.write('MESH2D\n')
+        for i, (a, b, c) in enumerate(tris):
+            f.write('E3T %d %d %d %d 1\n' % (i+1, a+1, b+1, c+1))
+        for i, (x, y, z) in enumerate(verts):
+            f.write('ND %d %.6f %.6f %.6f\n' % (i+1, x, y, z))
+
+
+def read_3dm_mesh_legacy(fpath, skiprows=1):
+    """
+    The pandas based 3DM reader the vectorized parser replaced.
+    """
+    all_df = pd.read_table(fpath, delim_whitespace=True, header=None, skiprows=skiprows,
+                           names=('row_type', 'cmp1', 'cmp2', 'cmp3', 'val'), index_col=1)
+    conns = all_df[all_df['row_type'].str.lower() == 'e3t'][['cmp1', 'cmp2', 'cmp3', 'val']].values.astype(int) - 1
+    pts = all_df[all_df['row_type'].str.lower() == 'nd'][['cmp1', 'cmp2', 'cmp3']].values.astype(float)
+    verts = pd.DataFrame(pts, columns=['x', 'y', 'z'])
+    tris = pd.DataFrame(conns, columns=['v0', 'v1', 'v2', 'mat'])
+    return tris, verts
+
+
+class Read3DM(object):
+
+    params = [100, 500]
+    param_names = ['nodes_per_side']
+
+    def setup(self, n):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'mesh.3dm')
+        write_3dm(self.path, *grid_mesh(n, n))
+
+    def teardown(self, n):
+        shutil.rmtree(self.tmpdir)
+
+    def time_read_3dm_mesh(self, n):
+        read_3dm_mesh(self.path, cache=False)
+
+    def time_read_3dm_mesh_legacy(self, n):
+        read_3dm_mesh_legacy(self.path)
+
+    def peakmem_read_3dm_mesh(self, n):
+        read_3dm_mesh(self.path, cache=False)
+
+    def peakmem_read_3dm_mesh_legacy(self, n):
+        read_3dm_mesh_legacy(self.path)
+
+
+class Write3DM(object):
+
+    params = [100, 500]
+    param_names = ['nodes_per_side']
+
+    def setup(self, n):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'mesh.3dm')
+        self.tris, self.verts = grid_mesh(n, n)
+
+    def teardown(self, n):
+        shutil.rmtree(self.tmpdir)
+
+    def time_write_3dm_mesh(self, n):
+        write_3dm_mesh(self.path, self.tris, self.verts)
+
+    def time_write_3dm_mesh_legacy(self, n):
+        write_3dm(self.path, self.tris, self.verts)
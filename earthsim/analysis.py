@@ -2,7 +2,9 @@
 PyViz-based tools for interactively creating plots dynamically from other plots.
 """
 
-from collections import Callable, Iterable
+import hashlib
+
+from collections import Callable, Iterable, OrderedDict
 
 import param
 import numpy as np
@@ -17,6 +19,59 @@ from holoviews import Curve, NdOverlay, DynamicMap, VLine, Image, TriMesh
 from holoviews.operation.datashader import datashade, rasterize
 from holoviews.util import Dynamic
 
+from .mesh import triangle_index
+
+
+def interpolate_line(parts, distance):
+    """
+    Interpolates points at the supplied distances along a line made
+    up of one or more parts, equivalent to shapely's linear
+    referencing but computed for all distances at once.
+
+    Parameters
+    ----------
+
+    parts: list(np.ndarray)
+        Coordinate arrays of shape (N, 2+) of each part of the line
+    distance: np.ndarray
+        Distances along the line to interpolate at
+
+    Returns
+    -------
+
+    xs: np.ndarray
+        x-coordinates of the interpolated points
+    ys: np.ndarray
+        y-coordinates of the interpolated points
+    """
+    coords = np.concatenate([p[:, :2] for p in parts])
+    seglen = np.hypot(*np.diff(coords, axis=0).T)
+    # Gaps between parts do not contribute to the length
+    gaps = np.cumsum([len(p) for p in parts])[:-1]-1
+    seglen[gaps] = 0
+    cumlen = np.concatenate([[0], np.cumsum(seglen)])
+    idx = np.clip(np.searchsorted(cumlen, distance, side='right')-1, 0, len(seglen)-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(seglen[idx] > 0, (distance-cumlen[idx])/seglen[idx], 0)
+    start, end = coords[idx], coords[idx+1]
+    xs, ys = (start + frac[:, None] * (end-start)).T
+    return xs, ys
+
+
+def _nearest_index(coords, values):
+    """
+    Returns the indexes of the closest of the sorted coordinates to
+    each of the supplied values.
+    """
+    if len(coords) < 2:
+        return np.zeros(len(values), dtype=int)
+    descending = coords[0] > coords[-1]
+    if descending:
+        coords = coords[::-1]
+    idx = np.clip(np.searchsorted(coords, values), 1, len(coords)-1)
+    idx = np.where(np.abs(values-coords[idx-1]) <= np.abs(values-coords[idx]), idx-1, idx)
+    return len(coords)-1-idx if descending else idx
+
 
 class LineCrossSection(param.Parameterized):
     """
@@ -35,6 +90,19 @@ class LineCrossSection(param.Parameterized):
         Distance between samples in meters. Used for interpolation
         of the cross-section paths.""")
 
+    sampling = param.ObjectSelector(default='rasterize', objects=['rasterize', 'interpolate'], doc="""
+        How to sample the data along the paths. 'rasterize' aggregates
+        the data onto a grid covering the paths and looks up the
+        nearest pixel, while 'interpolate' locates the triangle of a
+        TriMesh containing each sample and interpolates the node
+        values barycentrically, which scales with the number of
+        samples rather than the area covered by the paths. Data other
+        than TriMesh elements is always rasterized.""")
+
+    cache_size = param.Integer(default=32, bounds=(0, None), precedence=-1, doc="""
+        Maximum number of cross-sections cached, allowing the
+        sections of paths which were not edited to be reused.""")
+
     _num_objects = None
 
     def __init__(self, obj, paths=None, **params):
@@ -45,6 +113,8 @@ class LineCrossSection(param.Parameterized):
         self.path_stream = PolyDraw(source=self.path,
                                     num_objects=self._num_objects)
         PolyEdit(source=self.path)
+        self._section_cache = OrderedDict()
+        self._cached_obj = None
         self.sections = Dynamic(self.obj, operation=self._sample,
                                 streams=[self.path_stream])
         self.tiles = WMTS(self.tile_url)
@@ -56,21 +126,27 @@ class LineCrossSection(param.Parameterized):
         resolution. Returning the x- and y-coordinates along
         with the distance along the path.
         """
-        xs, ys, distance = [], [], []
         dist = geom.length
-        for d in np.linspace(0, dist, int(dist/self.resolution)):
-            point = geom.interpolate(d)
-            xs.append(point.x)
-            ys.append(point.y)
-            distance.append(d)
+        distance = np.linspace(0, dist, int(dist/self.resolution))
+        parts = geom.geoms if hasattr(geom, 'geoms') else [geom]
+        xs, ys = interpolate_line([np.asarray(p.coords) for p in parts], distance)
         return xs, ys, distance
 
 
+    def _mesh_index(self, obj):
+        """
+        Returns a TriangleIndex for the supplied TriMesh, which is
+        cached as long as the mesh is unchanged.
+        """
+        return triangle_index(obj.array([0, 1, 2]).astype(int), obj.nodes.array([0, 1]))
+
+
     def _sample(self, obj, data):
         """
         Rasterizes the supplied object in the current region
         and samples it with the drawn paths returning an
-        NdOverlay of Curves.
+        NdOverlay of Curves. The Curves of paths which have
+        not changed are reused from the cache.
 
         Note: Because the function returns an NdOverlay containing
         a variable number of elements batching must be enabled and
@@ -90,23 +166,69 @@ class LineCrossSection(param.Parameterized):
         else:
             return NdOverlay({0: Curve([], 'Distance', vdim)})
 
-        (x0, x1), (y0, y1) = x_range, y_range
-        width, height = (max([min([(x1-x0)/self.resolution, 500]), 10]),
-                         max([min([(y1-y0)/self.resolution, 500]), 10]))
-        raster = rasterize(obj, x_range=x_range, y_range=y_range,
-                           aggregator=self.aggregator, width=int(width),
-                           height=int(height), dynamic=False)
-        x, y = raster.kdims
-        sections = []
-        for g in path.geom():
-            xs, ys, distance = self._gen_samples(g)
-            indexes = {x.name: xs, y.name: ys}
-            points = raster.data.sel_points(method='nearest', **indexes).to_dataframe()
-            points['Distance'] = distance
-            sections.append(Curve(points, 'Distance', vdims=[vdim, x, y]))
+        if obj is not self._cached_obj:
+            self._section_cache.clear()
+            self._cached_obj = obj
+
+        if self.sampling == 'interpolate' and isinstance(obj, TriMesh):
+            grid = None
+        else:
+            (x0, x1), (y0, y1) = x_range, y_range
+            width, height = (max([min([(x1-x0)/self.resolution, 500]), 10]),
+                             max([min([(y1-y0)/self.resolution, 500]), 10]))
+            grid = (x_range, y_range, int(width), int(height))
+
+        # Look up cached sections, only sampling new or edited paths
+        sections, missing = [], []
+        for i, g in enumerate(path.geom()):
+            key = self._section_key(g, grid)
+            if key in self._section_cache:
+                self._section_cache.move_to_end(key)
+                sections.append(self._section_cache[key])
+            else:
+                sections.append(None)
+                missing.append((i, g, key))
+
+        if missing and grid is None:
+            index = self._mesh_index(obj)
+            values = obj.nodes.dimension_values(vdim)
+            x, y = obj.nodes.kdims[:2]
+            for i, g, key in missing:
+                xs, ys, distance = self._gen_samples(g)
+                samples = index.interpolate(values, xs, ys)
+                sections[i] = Curve((distance, samples, xs, ys), 'Distance',
+                                    vdims=[vdim, x, y])
+                self._section_cache[key] = sections[i]
+        elif missing:
+            x_range, y_range, width, height = grid
+            raster = rasterize(obj, x_range=x_range, y_range=y_range,
+                               aggregator=self.aggregator, width=width,
+                               height=height, dynamic=False)
+            x, y = raster.kdims
+            for i, g, key in missing:
+                xs, ys, distance = self._gen_samples(g)
+                indexes = {x.name: xs, y.name: ys}
+                points = raster.data.sel_points(method='nearest', **indexes).to_dataframe()
+                points['Distance'] = distance
+                sections[i] = Curve(points, 'Distance', vdims=[vdim, x, y])
+                self._section_cache[key] = sections[i]
+
+        while len(self._section_cache) > self.cache_size:
+            self._section_cache.popitem(last=False)
         return NdOverlay(dict(enumerate(sections)))
 
 
+    def _section_key(self, geom, grid=None):
+        """
+        Returns a key identifying the cross-section of a path, given
+        the sampling options and the raster grid (if any).
+        """
+        parts = geom.geoms if hasattr(geom, 'geoms') else [geom]
+        coords = [np.ascontiguousarray(p.coords) for p in parts]
+        digest = hashlib.sha1(b''.join(c.tobytes()+b'|' for c in coords)).hexdigest()
+        return (digest, self.resolution, self.aggregator, self.sampling, grid)
+
+
     def _pos_indicator(self, obj, x):
         """
         Returns an NdOverlay of Points indicating the current
@@ -150,11 +272,26 @@ class SurfaceCrossSection(LineCrossSection):
     SurfaceCrossSection rasterizes the input data, which should be a
     HoloMap or DynamicMap indexed by time and takes cross-sections of
     the resulting stack of images along paths drawn using a PolyDraw
-    tool.
+    tool. The frames are rasterized once onto a grid covering the
+    whole element, which is reused across edits to the path. When
+    interpolating a stack of TriMeshes the mesh is assumed to be the
+    same across time, so the samples are located once and only the
+    node values of the containing triangles are gathered from each
+    timestep.
     """
 
+    sampling = param.ObjectSelector(default='rasterize', objects=['rasterize', 'interpolate'], doc="""
+        How to sample the data along the paths. 'rasterize' aggregates
+        each timestep onto a grid covering the element and looks up
+        the nearest pixels, while 'interpolate' locates the triangle
+        of a TriMesh containing each sample and interpolates the node
+        values of each timestep, ignoring the aggregator. Data other
+        than TriMesh elements is always rasterized.""")
+
     _num_objects = 1
 
+    _raster_stack = None
+
     def _sample(self, obj, data):
         """
         Rasterizes the supplied object across times returning
@@ -169,33 +306,69 @@ class SurfaceCrossSection(LineCrossSection):
         else:
             vdim = obj.vdims[0]
 
-        if len(path) > 2:
-            x_range = path.range(0)
-            y_range = path.range(1)
-        else:
+        if len(path) <= 2:
             return Image([], ['Distance', 'Time'], vdim.name)
 
         g= path.geom()[-1]
         xs, ys, distance = self._gen_samples(g)
-        sections = []
 
         if isinstance(self.obj, DynamicMap):
             times = self.obj.kdims[0].values
         else:
             times = self.obj.keys()
 
+        if self.sampling == 'interpolate' and isinstance(obj, TriMesh):
+            # Locate the samples once, assuming the mesh is constant in
+            # time, and gather only the nodes of the containing triangles
+            index = self._mesh_index(self.obj[times[0]])
+            tri_ids, weights = index.query(xs, ys)
+            found = tri_ids >= 0
+            nodes, weights = index.tris[tri_ids[found]], weights[found]
+            samples = np.full((len(times), len(xs)), np.nan)
+            for i, t in enumerate(times):
+                values = self.obj[t].nodes.dimension_values(vdim)
+                samples[i, found] = (values[nodes]*weights).sum(axis=1)
+            return Image((distance, times, samples), ['Distance', self.obj.kdims[0]], vdim)
+
+        (x0, x1), (y0, y1), xcoords, ycoords, stack = self._rasterize_stack(times, vdim)
+
+        # Every frame shares the same grid so the nearest pixels are
+        # looked up once and gathered across the (time, y, x) stack,
+        # samples beyond the grid are masked
+        xidx = _nearest_index(xcoords, xs)
+        yidx = _nearest_index(ycoords, ys)
+        samples = stack[:, yidx, xidx]
+        samples[:, (xs < x0) | (xs > x1) | (ys < y0) | (ys > y1)] = np.nan
+        return Image((distance, times, samples), ['Distance', self.obj.kdims[0]], vdim)
+
+
+    def _rasterize_stack(self, times, vdim):
+        """
+        Rasterizes every frame onto a grid covering the extent of the
+        element returning the x- and y-range and coordinates of the
+        grid and a (time, y, x) array. Since the grid does not depend on the path
+        the stack is cached and reused across edits to the path.
+        """
+        frame = self.obj[times[0]]
+        element = frame.nodes if isinstance(frame, TriMesh) else frame
+        x_range, y_range = element.range(0), element.range(1)
         (x0, x1), (y0, y1) = x_range, y_range
-        width, height = (max([min([(x1-x0)/self.resolution, 500]), 10]),
-                         max([min([(y1-y0)/self.resolution, 500]), 10]))
+        width, height = (int(max([min([(x1-x0)/self.resolution, 500]), 10])),
+                         int(max([min([(y1-y0)/self.resolution, 500]), 10])))
+        key = (tuple(times), vdim.name, x_range, y_range, width, height, self.aggregator)
+        if self._raster_stack is not None and self._raster_stack[0] == key:
+            return self._raster_stack[1:]
+        self._raster_stack = None
+        arrays = []
         for t in times:
             raster = rasterize(self.obj[t], x_range=x_range, y_range=y_range,
-                               aggregator=self.aggregator, width=int(width),
-                               height=int(height), dynamic=False)
+                               aggregator=self.aggregator, width=width,
+                               height=height, dynamic=False)
             x, y = raster.kdims
-            indexes = {x.name: xs, y.name: ys}
-            points = raster.data.sel_points(method='nearest', **indexes).to_dataframe()
-            sections.append(points[vdim.name])
-        return Image((distance, times, np.vstack(sections)), ['Distance', self.obj.kdims[0]], vdim)
+            arrays.append(raster.data[vdim.name].transpose(y.name, x.name).values)
+        self._raster_stack = (key, x_range, y_range, raster.data[x.name].values,
+                              raster.data[y.name].values, np.stack(arrays))
+        return self._raster_stack[1:]
 
 
     def view(self, cmap=None, shade=True):
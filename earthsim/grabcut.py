@@ -2,6 +2,10 @@ import os
 import math
 import warnings
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import param
 import panel as pn
 import numpy as np
@@ -11,7 +15,6 @@ import cartopy.crs as ccrs
 import datashader as ds
 import quest
 
-from PIL import Image, ImageDraw
 from geoviews.util import path_to_geom_dicts
 from holoviews.core.operation import Operation
 from holoviews.core.options import Store, Options
@@ -22,29 +25,574 @@ from holoviews.operation.datashader import ResamplingOperation, rasterize, regri
 from holoviews.operation import contours
 from holoviews.streams import Stream, FreehandDraw, Params, BoxEdit, ParamMethod
 
+from .mesh import _array_hash
+
+
+def _round_half(x, up=True):
+    """
+    Rounds float32 values half up or half down (away from zero for
+    negative values) to integers, matching the rounding PIL applies
+    to the ends of each scanline span.
+    """
+    x = x.astype(np.float32)
+    half = np.float32(0.5)
+    if up:
+        rounded = np.where(x >= 0, np.floor(x + half), -np.floor(np.abs(x) + half))
+    else:
+        rounded = np.where(x >= 0, np.ceil(x - half), -np.ceil(np.abs(x) - half))
+    return rounded.astype(np.int64)
+
+
+def _roundf(x):
+    "Rounds half away from zero like C roundf."
+    x = x.astype(np.float64)
+    return np.where(x >= 0, np.floor(x + 0.5), -np.floor(-x + 0.5))
+
+
+def _polygon_edges(polygons):
+    """
+    Converts a list of polygons, each a list of rings in pixel
+    coordinates, into the start and end vertices and polygon ids of
+    all edges, truncating the coordinates to integers and closing
+    each ring the way PIL does.
+    """
+    rings = [np.asarray(ring, dtype=np.float64)[:, :2]
+             for rings in polygons for ring in rings]
+    poly_ids = [i for i, rings in enumerate(polygons) for _ in rings]
+    lengths = np.array([len(ring) for ring in rings], dtype=np.int64)
+    keep = lengths >= 2
+    if not keep.any():
+        empty = np.empty((0, 2), dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.int64)
+    coords = np.trunc(np.concatenate([r for r, k in zip(rings, keep) if k])).astype(np.int64)
+    lengths, poly_ids = lengths[keep], np.array(poly_ids, dtype=np.int64)[keep]
+
+    # Each vertex starts an edge to the next vertex, except the last
+    # vertex of a ring which is joined to the first if not already closed
+    last = np.cumsum(lengths) - 1
+    first = last - lengths + 1
+    nxt = np.arange(1, len(coords)+1)
+    nxt[last] = first
+    start = np.ones(len(coords), dtype=bool)
+    start[last] = (coords[last] != coords[first]).any(axis=1)
+    ids = np.repeat(poly_ids, lengths)
+    return coords[start], coords[nxt[start]], ids[start]
+
+
+def _scanline_crossings(p0, p1, ids, ymax, height):
+    """
+    Computes the float32 x-coordinate at which each non-horizontal
+    edge crosses each scanline it spans, applying the same vertex
+    handling as the PIL scanline polygon fill.
+    """
+    (x0, y0), (x1, y1) = p0.T, p1.T
+    emin, emax = np.minimum(y0, y1), np.maximum(y0, y1)
+    dx = (x1-x0).astype(np.float32) / (y1-y0).astype(np.float32)
+
+    def intersect(edge, y):
+        return (y-y0[edge]).astype(np.float32) * dx[edge] + x0[edge].astype(np.float32)
+
+    # Expand every edge into one crossing per scanline
+    lo = np.maximum(emin, 0)
+    hi = np.minimum(np.minimum(emax, ymax[ids]), height-1)
+    counts = np.maximum(hi-lo+1, 0)
+    edge = np.repeat(np.arange(len(p0)), counts)
+    offsets = np.repeat(np.cumsum(counts)-counts, counts)
+    y = lo[edge] + np.arange(counts.sum()) - offsets
+    xs = intersect(edge, y)
+
+    # Vertices shared by an edge ending on the scanline are counted twice
+    duplicate = (y == emax[edge]) & (y < ymax[ids[edge]])
+
+    # Connect corners of edges meeting at a vertex on the scanline to
+    # the crossings on the adjacent scanline, which only applies if the
+    # edge moves by more than a pixel between the two scanlines
+    one = np.float32(1)
+    corner = np.where(~duplicate & ((y == emin[edge]) | (y == emax[edge])) &
+                      (dx[edge] != 0))[0]
+    step = np.where(y[corner] == emax[edge[corner]], -1, 1)
+    adjacent = intersect(edge[corner], y[corner]+step)
+    shifted = (xs[corner] > adjacent+one) | (xs[corner] < adjacent-one)
+    corner, step, adjacent = corner[shifted], step[shifted], adjacent[shifted]
+
+    # Find the first preceding edge with a vertex at the same position
+    sloped = np.where(dx != 0)[0]
+    vertex_edge = np.concatenate([sloped, sloped])
+    vertex_y = np.concatenate([emin[sloped], emax[sloped]])
+    vertex_key = ids[vertex_edge] * 2**32 + vertex_y
+    order = np.lexsort((vertex_edge, vertex_key))
+    vertex_edge, vertex_key = vertex_edge[order], vertex_key[order]
+    key = ids[edge[corner]] * 2**32 + y[corner]
+    first = np.searchsorted(vertex_key, key, 'left')
+    npairs = np.searchsorted(vertex_key, key, 'right') - first
+    pair = np.repeat(np.arange(len(corner)), npairs)
+    other = vertex_edge[first[pair] + np.arange(npairs.sum()) -
+                        np.repeat(np.cumsum(npairs)-npairs, npairs)]
+    crossing, cy, cstep = corner[pair], y[corner[pair]], step[pair]
+    valid = ((other < edge[crossing]) &
+             (_roundf(xs[crossing]) == _roundf(intersect(other, cy))) &
+             (cy+cstep >= emin[other]) & (cy+cstep <= emax[other]))
+    pair, other = pair[valid], other[valid]
+    _, index = np.unique(pair, return_index=True)
+    pair, other = pair[index], other[index]
+    crossing, adjacent = corner[pair], adjacent[pair]
+    adjacent_other = intersect(other, y[crossing]+step[pair])
+    x = xs[crossing]
+    right = (x > adjacent+one) & (x > adjacent_other+one)
+    left = (x < adjacent-one) & (x < adjacent_other-one)
+    x = np.where(right, _roundf(np.maximum(adjacent, adjacent_other)) + 1, x)
+    x = np.where(left, _roundf(np.minimum(adjacent, adjacent_other)) - 1, x)
+    xs[crossing] = x
+
+    return (np.concatenate([xs, xs[duplicate]]),
+            np.concatenate([y, y[duplicate]]),
+            np.concatenate([ids[edge], ids[edge[duplicate]]]))
+
+
+def _fill_polygons(polygons, shape):
+    """
+    Rasterizes polygons into a boolean mask using an even-odd scanline
+    fill vectorized over all edges of all polygons at once. Each
+    polygon is filled independently and the results are combined, so
+    overlapping polygons are unioned while holes within a polygon are
+    left empty. Polygons without holes produce exactly the same pixels
+    as PIL's ImageDraw.polygon.
+
+    Parameters
+    ----------
+
+    polygons: list
+        List of polygons, each a list of rings given as (N, 2) arrays
+        of pixel coordinates, i.e. the exterior followed by any holes
+    shape: tuple
+        The (height, width) of the mask
+
+    Returns
+    -------
+
+    mask: np.ndarray
+        Boolean mask which is True inside the polygons
+    """
+    height, width = shape
+    p0, p1, ids = _polygon_edges(polygons)
+    npolys = len(polygons)
+
+    # Scanline extent of each polygon
+    ymax = np.zeros(npolys, dtype=np.int64)
+    np.maximum.at(ymax, ids, np.maximum(p0[:, 1], p1[:, 1]))
+    ymax = np.minimum(ymax, height)
+
+    # Horizontal edges are drawn as they are
+    horizontal = p0[:, 1] == p1[:, 1]
+    hrows = p0[horizontal, 1]
+    hstart = np.minimum(p0[horizontal, 0], p1[horizontal, 0])
+    hend = np.maximum(p0[horizontal, 0], p1[horizontal, 0])
+
+    # Pair up sorted crossings on each scanline of each polygon
+    xs, ys, pids = _scanline_crossings(p0[~horizontal], p1[~horizontal],
+                                       ids[~horizontal], ymax, height)
+    lines = pids * height + ys
+    if len(lines) and lines.max() < 2**31:
+        # Sort on a single key packing the line into the high bits
+        # and the order preserving integer bits of x into the low bits
+        bits = xs.view(np.uint32).astype(np.int64)
+        bits = np.where(bits >= 2**31, 2**32-1-bits, bits+2**31)
+        order = np.argsort((lines << 32) | bits)
+    else:
+        order = np.lexsort((xs, lines))
+    xs, ys, lines = xs[order], ys[order], lines[order]
+    new_line = np.ones(len(xs), dtype=bool)
+    new_line[1:] = lines[1:] != lines[:-1]
+    line_start = np.maximum.accumulate(np.where(new_line, np.arange(len(xs)), 0))
+    rank = np.arange(len(xs)) - line_start
+    left = np.where((rank % 2 == 0) & np.append(~new_line[1:], False))[0]
+
+    rows = np.concatenate([hrows, ys[left]])
+    start = np.concatenate([hstart, _round_half(xs[left], up=True)])
+    end = np.concatenate([hend, _round_half(xs[left+1], up=False)])
+
+    # Clip spans to the mask
+    start, end = np.maximum(start, 0), np.minimum(end, width-1)
+    valid = (rows >= 0) & (rows < height) & (start <= end)
+    start = rows[valid] * width + start[valid]
+    end = rows[valid] * width + end[valid]
+
+    # Merge overlapping and adjacent spans and fill them by toggling
+    # the mask at the span boundaries
+    mask = np.zeros(height*width+1, dtype=bool)
+    if len(start):
+        order = np.argsort(start, kind='mergesort')
+        start, end = start[order], np.maximum.accumulate(end[order])
+        new_span = np.ones(len(start), dtype=bool)
+        new_span[1:] = start[1:] > end[:-1]+1
+        mask[start[new_span]] = True
+        mask[end[np.append(new_span[1:], True)]+1] = True
+        np.logical_xor.accumulate(mask, out=mask)
+    return mask[:-1].reshape(height, width)
+
 
 class rasterize_polygon(ResamplingOperation):
     """
-    Rasterizes Polygons elements to a boolean mask using PIL
+    Rasterizes Polygons elements to a boolean mask using a vectorized
+    scanline fill, leaving any holes empty.
     """
 
     def _process(self, element, key=None):
         sampling = self._get_sampling(element, 0, 1)
         (x_range, y_range), (xvals, yvals), (width, height), (xtype, ytype) = sampling
         (x0, x1), (y0, y1) = x_range, y_range
-        img = Image.new('L', (width, height), 0)
-        draw = ImageDraw.Draw(img)
+        offset, scale = np.array([x0, y0]), np.array([x1-x0, y1-y0])
+        size = np.array([width, height])
+        polygons = []
         for poly in element.split():
+            holes = poly.holes()[0] if poly.has_holes else []
             poly = poly.reindex(vdims=[])
-            for p in split_path(poly):
-                xs, ys = (p.values if pd else p).T
-                xs = ((xs - x0) / (x1-x0) * width)
-                ys = ((ys - y0) / (y1-y0) * height)
-                draw.polygon(list(zip(xs, ys)), outline=1, fill=1)
-        img = np.array(img).astype('bool')
+            for i, p in enumerate(split_path(poly)):
+                rings = [p.values if pd else p]
+                rings += list(holes[i]) if i < len(holes) else []
+                polygons.append([(np.asarray(r)[:, :2] - offset) / scale * size
+                                 for r in rings])
+        img = _fill_polygons(polygons, (height, width))
         return hv.Image((xvals, yvals, img), element.kdims)
 
 
+def _import_cv():
+    try:
+        import cv2 as cv
+    except:
+        # HACK: Avoids error loading OpenCV the first time
+        # ImportError dlopen: cannot load any more object with static TLS
+        try:
+            import cv2 as cv
+        except ImportError:
+            raise ImportError('GrabCut algorithm requires openCV')
+    return cv
+
+
+def _grabcut(img, mask, iterations, models=None, freeze=True):
+    """
+    Runs GrabCut on an image given an initial mask of GrabCut labels
+    (0: background, 1: foreground, 2: probable background, 3: probable
+    foreground) returning the updated labels and the (bgdModel,
+    fgdModel) models. If models are supplied they are either kept
+    fixed, computing the labels from them directly, or if freeze is
+    disabled used as the starting point for further iterations.
+    Otherwise the models are learned from the mask. Learning requires
+    both foreground and background samples, so if either is missing
+    or no pixel is undecided the mask is returned unchanged.
+    """
+    fg = (mask == 1) | (mask == 3)
+    learn = models is None or not freeze
+    if not (mask >= 2).any() or (learn and (fg.all() or not fg.any())):
+        return mask, models
+    cv = _import_cv()
+    if models is None:
+        bgdModel = np.zeros((1,65), np.float64)
+        fgdModel = np.zeros((1,65), np.float64)
+        mode = cv.GC_INIT_WITH_MASK
+    else:
+        bgdModel, fgdModel = (m.copy() for m in models)
+        mode = cv.GC_EVAL
+        if freeze:
+            mode, iterations = cv.GC_EVAL_FREEZE_MODEL, 1
+    mask, bgdModel, fgdModel = cv.grabCut(np.ascontiguousarray(img), mask.astype('uint8'), None,
+                                          bgdModel, fgdModel, iterations, mode)
+    return mask, (bgdModel, fgdModel)
+
+
+def _warm_grabcut(img, mask, iterations, refine_iterations=2, state=None, key='image'):
+    """
+    Runs GrabCut resuming from the labels and models of a previous
+    run stored in the state dictionary under the key and image shape.
+    The key must identify the region of the image the labels are
+    aligned to, e.g. the crop bounds and subsampling factor.
+    The previous labels are demoted to probable labels, so only the
+    current strokes are definite, and refine_iterations iterations are
+    run starting from the previous models. Without a previous run
+    GrabCut is initialized from the mask. The new labels and models
+    are stored in the state.
+    """
+    key = (key, img.shape)
+    previous = None if state is None else state.get(key)
+    if previous is None:
+        labels, models = _grabcut(img, mask, iterations)
+    else:
+        prev_labels, models = previous
+        resumed = np.where(mask >= 2, prev_labels | 2, mask).astype('uint8')
+        labels, models = _grabcut(img, resumed, refine_iterations, models, freeze=False)
+    if state is not None and models is not None:
+        state[key] = (labels, models)
+    return labels, models
+
+
+def _grabcut_tile(args):
+    """
+    Runs GrabCut on a single tile, unpacking the arguments so the
+    function may be mapped over a process pool.
+    """
+    return _grabcut(*args)[0]
+
+
+def _downsample_labels(mask, factor):
+    """
+    Downsamples a mask of GrabCut labels by an integer factor, marking
+    each block as definite background if it contains any background
+    stroke and otherwise as definite foreground if it contains any
+    foreground stroke, so thin strokes are never lost.
+    """
+    h, w = mask.shape
+    rows, cols = np.arange(0, h, factor), np.arange(0, w, factor)
+    def any_block(arr):
+        return np.logical_or.reduceat(np.logical_or.reduceat(arr, rows, axis=0), cols, axis=1)
+    return np.where(any_block(mask == 0), 0, np.where(any_block(mask == 1), 1, 2)).astype('uint8')
+
+
+def _learn_models(img, mask, iterations, max_pixels, min_samples=100,
+                  refine_iterations=2, state=None, bounds=None):
+    """
+    Learns the background and foreground GrabCut models of an image
+    subsampled to at most max_pixels pixels. The pixels are strided
+    rather than averaged so the color distributions are preserved and
+    the subsampling is reduced if fewer than min_samples foreground or
+    background stroke pixels would remain, since the models
+    degenerate when fitted to only a handful of samples. Learning
+    resumes from the models of a previous run if a state is supplied,
+    which is only reused for the same crop bounds and subsampling.
+    """
+    h, w = mask.shape
+    factor = int(np.ceil(np.sqrt(h*w/float(max_pixels))))
+    while factor > 1:
+        labels = _downsample_labels(mask, factor)
+        if min((labels == 0).sum(), (labels == 1).sum()) >= min_samples:
+            img, mask = img[::factor, ::factor], labels
+            break
+        factor //= 2
+    key = ('models', bounds, factor)
+    return _warm_grabcut(img, mask, iterations, refine_iterations, state, key)[1]
+
+
+def _tile_windows(bounds, tile_size, overlap, shape):
+    """
+    Splits the region (r0, c0, r1, c1) into tiles, yielding the
+    (r0, c0, r1, c1) window of each tile core and the window expanded
+    by the overlap and clipped to the image shape.
+    """
+    r0, c0, r1, c1 = bounds
+    for r in range(r0, r1, tile_size):
+        for c in range(c0, c1, tile_size):
+            core = (r, c, min(r+tile_size, r1), min(c+tile_size, c1))
+            window = (max(core[0]-overlap, 0), max(core[1]-overlap, 0),
+                      min(core[2]+overlap, shape[0]), min(core[3]+overlap, shape[1]))
+            yield core, window
+
+
+def _run_tiles(img, mask, windows, iterations, models=None, workers=1):
+    """
+    Runs GrabCut on each (core, window) tile of the mask, skipping
+    tiles whose core contains no undecided pixels, and returns the
+    mask updated with the labels of each tile core. If multiple
+    workers are requested tiles are processed on a process pool.
+    """
+    windows = [(core, window) for core, window in windows
+               if (mask[core[0]:core[2], core[1]:core[3]] >= 2).any()]
+
+    def tasks(windows):
+        for _, (wr0, wc0, wr1, wc1) in windows:
+            yield (img[wr0:wr1, wc0:wc1], mask[wr0:wr1, wc0:wc1], iterations, models)
+
+    result = mask.copy()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # Submit tiles in batches to bound the memory held by queued tiles
+        batch = max(workers*2, 1)
+        for i in range(0, len(windows), batch):
+            chunk = windows[i:i+batch]
+            if executor is None:
+                labels = map(_grabcut_tile, tasks(chunk))
+            else:
+                labels = executor.map(_grabcut_tile, tasks(chunk))
+            for ((tr0, tc0, tr1, tc1), (wr0, wc0, _, _)), tile in zip(chunk, labels):
+                result[tr0:tr1, tc0:tc1] = tile[tr0-wr0:tr1-wr0, tc0-wc0:tc1-wc0]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return result
+
+
+def _tiled_grabcut(img, mask, iterations, tile_size=1024, overlap=64, margin=64, workers=1,
+                   refine_iterations=2, state=None):
+    """
+    Runs GrabCut on overlapping tiles covering the bounding region of
+    the definite labels in the mask plus a margin, so the memory used
+    by GrabCut is bounded by the tile size. The color models are
+    learned once on the region downsampled to the size of a single
+    tile and then held fixed while segmenting each tile, so tiles
+    without any strokes are labelled consistently. Each tile is
+    segmented with the overlapping context around it and only the
+    labels of its core are retained, stitching the tiles without
+    seams. Pixels outside the region retain their initial labels.
+    """
+    rows, cols = np.nonzero(mask < 2)
+    if not len(rows) or not (mask == 1).any() or not (mask == 0).any():
+        return mask
+    h, w = mask.shape
+    r0, c0 = max(rows.min()-margin, 0), max(cols.min()-margin, 0)
+    r1, c1 = min(rows.max()+margin+1, h), min(cols.max()+margin+1, w)
+    models = _learn_models(img[r0:r1, c0:c1], mask[r0:r1, c0:c1], iterations, tile_size**2,
+                           refine_iterations=refine_iterations, state=state,
+                           bounds=(r0, c0, r1, c1))
+    windows = _tile_windows((r0, c0, r1, c1), tile_size, overlap, mask.shape)
+    return _run_tiles(img, mask, windows, iterations, models, workers)
+
+
+def _dilate(mask, iterations):
+    """
+    Dilates a boolean mask by the given number of pixels using the
+    8-connected neighborhood.
+    """
+    mask = mask.copy()
+    for _ in range(iterations):
+        grown = mask.copy()
+        grown[1:] |= mask[:-1]
+        grown[:-1] |= mask[1:]
+        grown[:, 1:] |= grown[:, :-1].copy()
+        grown[:, :-1] |= grown[:, 1:].copy()
+        mask = grown
+    return mask
+
+
+def _pyramid_grabcut(img, mask, iterations, levels=3, band=2, tile_size=256,
+                     overlap=32, workers=1, min_samples=100, refine_iterations=2,
+                     state=None):
+    """
+    Runs GrabCut coarse-to-fine on an image pyramid. GrabCut is run
+    on the whole image only at the coarsest level, at each finer
+    level only the pixels within a band around the upsampled boundary
+    of the coarser result are left undecided while all other pixels
+    are fixed to definite foreground or background, and only the
+    tiles intersecting the band are refined. The pyramid is truncated
+    if fewer than min_samples stroke pixels would remain at a level.
+    """
+    h, w = mask.shape
+    small_mask = _downsample_labels(mask, 2) if levels > 1 and min(h, w) > 1 else None
+    if (small_mask is None or (small_mask == 0).sum() < min_samples or
+        (small_mask == 1).sum() < min_samples):
+        return _warm_grabcut(img, mask, iterations, refine_iterations, state)[0]
+
+    cv = _import_cv()
+    small_img = cv.resize(np.ascontiguousarray(img), small_mask.shape[::-1],
+                          interpolation=cv.INTER_AREA)
+    coarse = _pyramid_grabcut(small_img, small_mask, iterations, levels-1, band,
+                              tile_size, overlap, workers, min_samples,
+                              refine_iterations, state) % 2 == 1
+
+    # Mark the band around the boundary of the coarse result as undecided
+    edges = np.zeros_like(coarse)
+    edges[1:] |= coarse[1:] != coarse[:-1]
+    edges[:-1] |= coarse[1:] != coarse[:-1]
+    edges[:, 1:] |= coarse[:, 1:] != coarse[:, :-1]
+    edges[:, :-1] |= coarse[:, 1:] != coarse[:, :-1]
+    undecided = _dilate(edges, band)
+    upsample = lambda arr: arr.repeat(2, axis=0).repeat(2, axis=1)[:h, :w]
+    fg, undecided = upsample(coarse), upsample(undecided)
+    labels = np.where(undecided, np.where(fg, 3, 2), np.where(fg, 1, 0)).astype('uint8')
+    labels[mask == 1] = 1
+    labels[mask == 0] = 0
+
+    windows = _tile_windows((0, 0, h, w), tile_size, overlap, mask.shape)
+    return _run_tiles(img, labels, windows, iterations, workers=workers)
+
+
+class StrokeMaskCache(object):
+    """
+    Memoizes the boolean masks rasterized from named sets of strokes
+    onto a target grid. Each stroke is identified by a hash of its
+    data, so a mask is only rasterized again when the strokes or the
+    grid change. Strokes added since the previous lookup are
+    rasterized on their own and OR-ed into the cached mask, so the
+    cost of updating a mask tracks the edit rather than the total
+    number of strokes.
+    """
+
+    def __init__(self, cache_size=4):
+        self.cache_size = cache_size
+        self._masks = OrderedDict()
+
+    def clear(self):
+        self._masks.clear()
+
+    def mask(self, name, grid, shape, strokes, rasterize):
+        """
+        Returns the mask of the supplied strokes on the target grid.
+
+        Parameters
+        ----------
+
+        name: str
+            Name of the set of strokes, e.g. 'foreground'
+        grid: tuple
+            Hashable description of the target grid
+        shape: tuple
+            The (height, width) of the mask
+        strokes: list
+            List of (hash, stroke) tuples
+        rasterize: callable
+            Function rasterizing a list of strokes onto the target grid
+
+        Returns
+        -------
+
+        mask: np.ndarray
+            Boolean mask which is True where any stroke was drawn,
+            owned by the cache and updated in place as strokes are
+            added, so it should not be modified
+        """
+        key = (name, grid, tuple(shape))
+        strokes = OrderedDict(strokes)
+        hashes = set(strokes)
+        if key in self._masks:
+            self._masks.move_to_end(key)
+            cached, mask = self._masks[key]
+            if cached == hashes:
+                return mask
+            elif cached < hashes:
+                added = [stroke for h, stroke in strokes.items() if h not in cached]
+                mask |= self._rasterize(rasterize, added, shape)
+            else:
+                mask = self._rasterize(rasterize, list(strokes.values()), shape)
+        else:
+            mask = self._rasterize(rasterize, list(strokes.values()), shape)
+        self._masks[key] = (hashes, mask)
+        while len(self._masks) > self.cache_size:
+            self._masks.popitem(last=False)
+        return mask
+
+    @classmethod
+    def _rasterize(cls, rasterize, strokes, shape):
+        if not strokes:
+            return np.zeros(shape, dtype=bool)
+        mask = np.asarray(rasterize(strokes))
+        if mask.dtype.kind != 'b':
+            mask = np.isfinite(mask) & (mask != 0)
+        elif not mask.flags.writeable:
+            mask = mask.copy()
+        return mask
+
+
+def _path_strokes(element):
+    """
+    Splits a Path element into its individual strokes, returning a
+    list of (hash, stroke) tuples.
+    """
+    strokes = []
+    for stroke in element.split():
+        arrays = [stroke.array([0, 1])]
+        if isinstance(stroke, hv.Polygons) and stroke.has_holes:
+            arrays += [hole for holes in stroke.holes()[0] for hole in holes]
+        strokes.append((_array_hash(*arrays), stroke))
+    return strokes
+
+
 class extract_foreground(Operation):
     """
     Uses Grabcut algorithm to extract the foreground from an image given
@@ -58,44 +606,102 @@ class extract_foreground(Operation):
     iterations = param.Integer(default=5, bounds=(0, 20), doc="""
         Number of iterations to run the GrabCut algorithm for.""")
 
+    tile_size = param.Integer(default=None, bounds=(16, None), allow_None=True, doc="""
+        If set GrabCut is run on overlapping tiles of this size
+        covering the region around the foreground and background
+        strokes, bounding the memory used by GrabCut and allowing
+        large images to be processed at full resolution.""")
+
+    overlap = param.Integer(default=64, bounds=(0, None), doc="""
+        Number of pixels of context around each tile.""")
+
+    margin = param.Integer(default=64, bounds=(0, None), doc="""
+        Number of pixels around the bounding region of the strokes
+        to process in tiled mode, pixels outside it are background.""")
+
+    workers = param.Integer(default=1, bounds=(1, None), doc="""
+        Number of processes used to process tiles in parallel.""")
+
+    levels = param.Integer(default=1, bounds=(1, None), doc="""
+        Number of levels of the image pyramid. If greater than one,
+        GrabCut is run on the image downsampled by a factor of two per
+        level and the result is refined at each finer level only
+        within a band around the coarser boundary, processing the
+        band in tiles of tile_size (256 pixels if unset).""")
+
+    band = param.Integer(default=2, bounds=(1, None), doc="""
+        Width in pixels of the band around the boundary of each
+        coarser level which is refined at the next finer level.""")
+
+    state = param.Dict(default=None, allow_None=True, instantiate=False, doc="""
+        Dictionary in which the GrabCut labels and color models are
+        stored between runs. If supplied, subsequent runs on an image
+        of the same shape resume from the previous result for
+        refine_iterations iterations instead of starting from
+        scratch. Should be cleared whenever the image changes.""")
+
+    refine_iterations = param.Integer(default=2, bounds=(0, 20), doc="""
+        Number of iterations to run when resuming from a previous run.""")
+
+    mask_cache = param.ClassSelector(default=None, class_=StrokeMaskCache, allow_None=True,
+                                     instantiate=False, doc="""
+        Cache in which the rasterized foreground and background masks
+        are memoized between runs, so each set of strokes is only
+        rasterized again when it changes and added strokes are
+        rasterized incrementally.""")
+
     def _process(self, element, key=None):
-        try:
-            import cv2 as cv
-        except:
-            # HACK: Avoids error loading OpenCV the first time
-            # ImportError dlopen: cannot load any more object with static TLS
-            try:
-                import cv2 as cv
-            except ImportError:
-                raise ImportError('GrabCut algorithm requires openCV')
-
-        if isinstance(self.p.foreground, hv.Polygons):
+        polygons = isinstance(self.p.foreground, hv.Polygons)
+        if polygons:
             rasterize_op = rasterize_polygon
         else:
             rasterize_op = rasterize.instance(aggregator=ds.any())
 
-        kwargs = {'dynamic': False, 'target': element}
-        fg_mask = rasterize_op(self.p.foreground, **kwargs)
-        bg_mask = rasterize_op(self.p.background, **kwargs)
-        fg_mask = fg_mask.dimension_values(2, flat=False)
-        bg_mask = bg_mask.dimension_values(2, flat=False)
-        if fg_mask[np.isfinite(fg_mask)].sum() == 0 or bg_mask[np.isfinite(bg_mask)].sum() == 0:
+        def rasterize_strokes(paths, strokes):
+            paths = paths.clone([stroke.data for stroke in strokes])
+            mask = rasterize_op(paths, dynamic=False, target=element)
+            return mask.dimension_values(2, flat=False)
+
+        cache = self.p.mask_cache
+        if cache is None:
+            cache = StrokeMaskCache()
+        grid = (polygons, tuple(element.bounds.lbrt()))
+        shape = element.interface.shape(element, gridded=True)[:2]
+        masks = []
+        for name, paths in [('foreground', self.p.foreground), ('background', self.p.background)]:
+            masks.append(cache.mask(name, grid, shape, _path_strokes(paths),
+                                    partial(rasterize_strokes, paths)))
+        fg_mask, bg_mask = masks
+        if not fg_mask.any() or not bg_mask.any():
             return element.clone([], vdims=['Foreground'], new_type=gv.Image,
                                  crs=element.crs)
 
-        mask = np.where(fg_mask, 1, 2)
-        mask = np.where(bg_mask, 0, mask).copy()
-        bgdModel = np.zeros((1,65), np.float64)
-        fgdModel = np.zeros((1,65), np.float64)
+        mask = np.full(fg_mask.shape, 2, dtype='uint8')
+        mask[fg_mask] = 1
+        mask[bg_mask] = 0
 
         if isinstance(element, hv.RGB):
-            img = np.dstack([element.dimension_values(d, flat=False)
-                             for d in element.vdims])
+            # Fill the channels one at a time to avoid holding a copy
+            # of every channel alongside the stacked image
+            channels = (element.dimension_values(d, flat=False) for d in element.vdims)
+            first = next(channels)
+            img = np.empty(first.shape+(len(element.vdims),), dtype=first.dtype)
+            img[..., 0] = first
+            for i, channel in enumerate(channels, 1):
+                img[..., i] = channel
         else:
             img = element.dimension_values(2, flat=False)
-        mask, _, _ = cv.grabCut(img, mask.astype('uint8'), None, bgdModel, fgdModel,
-                                self.p.iterations, cv.GC_INIT_WITH_MASK)
-        fg_mask = np.where((mask==2)|(mask==0),0,1).astype('bool')
+        warm = dict(refine_iterations=self.p.refine_iterations, state=self.p.state)
+        if self.p.levels > 1:
+            mask = _pyramid_grabcut(img, mask, self.p.iterations, self.p.levels, self.p.band,
+                                    self.p.tile_size or 256, self.p.overlap, self.p.workers,
+                                    **warm)
+        elif self.p.tile_size:
+            mask = _tiled_grabcut(img, mask, self.p.iterations, self.p.tile_size,
+                                  self.p.overlap, self.p.margin, self.p.workers, **warm)
+        else:
+            mask, _ = _warm_grabcut(img, mask, self.p.iterations, **warm)
+        fg_mask = (mask == 1) | (mask == 3)
         xs, ys = (element.dimension_values(d, expanded=False) for d in element.kdims)
         return element.clone((xs, ys, fg_mask), vdims=['Foreground'], new_type=gv.Image,
                              crs=element.crs)
@@ -153,6 +759,25 @@ class GrabCutPanel(param.Parameterized):
     iterations = param.Integer(default=5, precedence=1, bounds=(0, 20), doc="""
         Number of iterations to run the GrabCut algorithm for.""")
 
+    tile_size = param.Integer(default=None, bounds=(16, None), allow_None=True,
+                              precedence=1, doc="""
+        If set GrabCut is run on overlapping tiles of this size
+        around the strokes, bounding the memory used by GrabCut itself
+        so large images may be processed at full resolution. The image
+        and the label mask are still held in memory in full.""")
+
+    workers = param.Integer(default=1, bounds=(1, None), precedence=1, doc="""
+        Number of processes used to run GrabCut tiles in parallel.""")
+
+    levels = param.Integer(default=1, bounds=(1, 8), precedence=1, doc="""
+        Number of levels of the coarse-to-fine image pyramid, GrabCut
+        runs on the coarsest level and finer levels only refine a band
+        around the boundary, keeping full resolution boundaries.""")
+
+    refine_iterations = param.Integer(default=2, precedence=1, bounds=(0, 20), doc="""
+        Number of iterations to run when refining the previous result
+        after the strokes were edited.""")
+
     clear = param.Action(default=lambda o: o._trigger_clear(),
                                   precedence=2, doc="""
         Button to clear drawn annotations.""")
@@ -189,6 +814,12 @@ class GrabCutPanel(param.Parameterized):
         self.draw_fg = FreehandDraw(source=self.fg_paths)
         self._initialized = False
         self._clear = False
+        self._grabcut_state = {}
+        self._mask_cache = StrokeMaskCache()
+
+    @param.depends('image', 'downsample', watch=True)
+    def _reset_grabcut_state(self):
+        self._grabcut_state.clear()
 
     def _trigger_clear(self):
         self._clear = True
@@ -232,7 +863,11 @@ class GrabCutPanel(param.Parameterized):
             img = regrid(img, **kwargs)
 
         foreground = extract_foreground(img, background=bg, foreground=fg,
-                                        iterations=self.iterations)
+                                        iterations=self.iterations,
+                                        tile_size=self.tile_size, workers=self.workers,
+                                        levels=self.levels, state=self._grabcut_state,
+                                        mask_cache=self._mask_cache,
+                                        refine_iterations=self.refine_iterations)
         foreground = gv.Path([contours(foreground, filled=True, levels=1).split()[0].data],
                              kdims=foreground.kdims, crs=foreground.crs)
         self.result = gv.project(foreground, projection=self.crs)
@@ -2,16 +2,153 @@
 Input and output for geo-specific data formats.
 """
 
+import io
+import os
+import json
+import mmap
+import shutil
+import hashlib
+import tempfile
+
+from collections.abc import Mapping
+
+import param
 import numpy as np
 import pandas as pd
 import fiona
+import dask
+import dask.array as da
 import geoviews as gv
-import dask.dataframe as dd
 import xarray as xr
 import cartopy.crs as ccrs
 
 from osgeo import gdal, osr
 
+from .mesh import subset_mesh
+
+
+
+class DiskCache(param.Parameterized):
+    """
+    On-disk cache of arrays decoded from text based file formats.
+
+    Entries are keyed on the path, modification time and size of the
+    source file along with any options that affect decoding. Each
+    entry is a directory of .npy files which are memory-mapped when
+    read back, so repeat loads skip parsing entirely and only page in
+    the data that is accessed. The least recently used entries are
+    evicted once the total size exceeds max_size.
+
+    Populating an entry parses the whole file, so the cache is
+    disabled by default and is best enabled for files which are
+    loaded in full repeatedly, e.g.:
+
+        disk_cache.enabled = True
+        disk_cache.directory = '/scratch/earthsim-cache'
+    """
+
+    enabled = param.Boolean(default=False, doc="""
+        Whether readers in earthsim.io use the cache unless a reader
+        is explicitly told otherwise.""")
+
+    directory = param.String(default=os.environ.get(
+        'EARTHSIM_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'earthsim-cache')), doc="""
+        Directory the cache entries are stored in, may be set with
+        the EARTHSIM_CACHE_DIR environment variable.""")
+
+    max_size = param.Integer(default=10*1024**3, bounds=(0, None), doc="""
+        Maximum total size of the cache in bytes.""")
+
+    # Incremented whenever the layout or parsing of the cached arrays changes
+    version = 3
+
+    def key(self, fpath, **kwargs):
+        """
+        Returns the cache key for a file and the supplied decoding options.
+        """
+        stat = os.stat(fpath)
+        token = repr((self.version, os.path.abspath(fpath), stat.st_mtime_ns,
+                      stat.st_size, sorted(kwargs.items())))
+        return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Returns a tuple of the memory-mapped arrays and attributes
+        stored under the key or None if there is no such entry.
+        """
+        path = os.path.join(self.directory, key)
+        meta_path = os.path.join(path, 'meta.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            os.utime(meta_path, None)
+            arrays = {name: np.load(os.path.join(path, name+'.npy'), mmap_mode='r')
+                      for name in meta['arrays']}
+        except (IOError, OSError, ValueError):
+            return None
+        return arrays, meta['attrs']
+
+    def put(self, key, arrays, attrs=None):
+        """
+        Stores a dictionary of NumPy or dask arrays and JSON
+        serializable attributes under the key. Dask arrays are
+        computed block by block straight into the file. Returns the
+        stored entry as if it had been looked up with get.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            for name, arr in arrays.items():
+                fname = os.path.join(tmp, name+'.npy')
+                if isinstance(arr, da.Array):
+                    out = np.lib.format.open_memmap(fname, mode='w+', dtype=arr.dtype,
+                                                    shape=arr.shape)
+                    da.store(arr, out, lock=True)
+                    out.flush()
+                    del out
+                else:
+                    np.save(fname, np.asarray(arr))
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({'arrays': list(arrays), 'attrs': attrs or {}}, f)
+            os.rename(tmp, os.path.join(self.directory, key))
+        except OSError:
+            # Entry was written concurrently or directory is not writable
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+        return self.get(key)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the total size
+        of the cache is below max_size.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            meta_path = os.path.join(path, 'meta.json')
+            if key.startswith('.') or not os.path.isfile(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(meta_path), size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+disk_cache = DiskCache(name='disk_cache')
+
 
 def get_sampling(bounds, shape):
     """
@@ -34,37 +171,133 @@ def get_sampling(bounds, shape):
     return xs, ys
 
 
-def open_gssha(filename):
+_FLOAT_CHARS = np.frombuffer(b'.eEnNiI', dtype=np.uint8)
+
+
+def _line_offsets(filename, start, nrows, blocksize=2**24):
+    """
+    Scans a text file from the supplied byte offset and returns the
+    byte offsets of the first nrows lines along with the end of the
+    last line, and whether the lines only contain integer values. The
+    file is read in fixed size blocks so memory usage is independent
+    of the file size.
+    """
+    offsets = np.empty(nrows+1, dtype=np.int64)
+    offsets[0] = start
+    n, pos, integer = 1, start, True
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        while n <= nrows:
+            block = f.read(blocksize)
+            if not block:
+                break
+            arr = np.frombuffer(block, dtype=np.uint8)
+            nl = np.flatnonzero(arr == 10)
+            take = min(len(nl), nrows+1-n)
+            if integer:
+                # Decimal points, exponents, nan and inf imply floats
+                end = nl[take-1]+1 if take and n+take > nrows else len(arr)
+                integer = not np.isin(arr[:end], _FLOAT_CHARS).any()
+            offsets[n:n+take] = nl[:take] + pos + 1
+            n += take
+            pos += len(block)
+    if n == nrows and pos > offsets[n-1]:
+        # Last line is not terminated by a newline
+        offsets[n] = pos
+        n += 1
+    if n <= nrows:
+        raise ValueError('Expected %d rows of data in %s, found %d.'
+                         % (nrows, filename, n-1))
+    return offsets, integer
+
+
+def _read_rows(filename, start, stop, ncols, dtype=np.float64):
+    """
+    Parses the whitespace delimited rows between the start and
+    stop byte offsets of a text file into a 2D array.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        buf = f.read(stop-start)
+    return np.array(buf.split(), dtype=dtype).reshape(-1, ncols)
+
+
+def open_gssha(filename, chunks=1000, cache=None):
     """
     Reads various filetypes produced by GSSHA
+
+    The header is parsed eagerly but the grid itself is returned as a
+    dask array, which is parsed lazily in blocks of rows, i.e. only the
+    rows that are actually accessed are ever read from disk. Grids
+    which only contain integers, e.g. .idx and .msk files, are
+    returned as int64 and all other grids as float64. If the
+    disk cache is used the first read instead parses the whole grid
+    into the cache and subsequent reads memory-map it.
+
+    Parameters
+    ----------
+
+    filename: str
+        Path to the .asc, .fgd or .ele file
+    chunks: int
+        Number of rows to parse per block
+    cache: boolean or None
+        Whether to use the disk_cache, defaults to disk_cache.enabled
+
+    Returns
+    -------
+
+    grid: xr.DataArray
+        Dask backed DataArray of the grid with ascending y-coordinates
     """
+    cache = disk_cache.enabled if cache is None else cache
+    if cache:
+        key = disk_cache.key(filename, reader='gssha')
+        entry = disk_cache.get(key)
+        if entry is not None:
+            arrays, _ = entry
+            return xr.DataArray(da.from_array(arrays['z'], chunks=(chunks, -1)),
+                                coords={'x': arrays['x'], 'y': arrays['y']},
+                                name='z', dims=['y', 'x'])
+
     # Read metadata
     ftype = filename.split('.')[-1]
+    with open(filename, 'rb') as f:
+        header = [f.readline().decode('utf-8').split() for _ in range(6)]
+        data_start = f.tell()
     if ftype in ['fgd', 'asc']:
-        f = open(filename, 'r')
         c, r, xlc, ylc, gsize, nanval = [
-            t(f.readline().split(' ')[-1].split('\n')[0])
-            for t in [int, int, float, float, float, float]
+            t(line[-1]) for t, line in
+            zip([int, int, float, float, float, float], header)
         ]
-        xs = np.linspace(xlc+gsize/2., xlc+c*gsize-gsize/2., c+1)
+        xs = np.linspace(xlc+gsize/2., xlc+c*gsize-gsize/2., c)
         ys = np.linspace(ylc+gsize/2., ylc+r*gsize-gsize/2., r)
     else:
-        header_df = pd.read_table(filename, engine='python',
-                              names=['meta_key', 'meta_val'],
-                              sep=' ', nrows=6)
-        bounds = header_df.loc[:3, 'meta_val'].values.astype(float)
-        r, c = header_df.loc[4:6, 'meta_val'].values.astype(int)
+        bounds = [float(line[-1]) for line in header[:4]]
+        r, c = [int(line[-1]) for line in header[4:6]]
         xs, ys = get_sampling(bounds, (r, c))
-    
-    # Read data using dask
-    ddf = dd.read_csv(filename, skiprows=6, header=None,
-                      sep=' ')
-    darr = ddf.values.compute()
-        
+
+    # Index the rows and declare lazy blocks of rows
+    offsets, integer = _line_offsets(filename, data_start, r)
+    dtype = np.int64 if integer and ftype != 'fgd' else np.float64
+    read_rows = dask.delayed(_read_rows, pure=True)
+    blocks = []
+    for i in range(0, r, chunks):
+        j = min(i+chunks, r)
+        block = read_rows(filename, offsets[i], offsets[j], c, dtype)
+        blocks.append(da.from_delayed(block, (j-i, c), dtype=dtype))
+    darr = da.concatenate(blocks, axis=0)
+
     if ftype == 'fgd':
-        darr[darr==nanval] = np.NaN
-    
-    return xr.DataArray(darr[::-1], coords={'x': xs, 'y': ys},
+        darr = da.where(darr == nanval, np.nan, darr)
+
+    # Rows are stored north to south, flip lazily to match ascending ys
+    darr = darr[::-1]
+    if cache:
+        entry = disk_cache.put(key, {'z': darr, 'x': xs, 'y': ys})
+        if entry is not None:
+            darr = da.from_array(entry[0]['z'], chunks=(chunks, -1))
+    return xr.DataArray(darr, coords={'x': xs, 'y': ys},
                         name='z', dims=['y', 'x'])
 
 
@@ -80,15 +313,168 @@ def get_ccrs(filename):
     return ccrs.epsg(projcs)
 
 
-def read_3dm_mesh(fpath, skiprows=1):
+#: Numeric columns following each 3DM card, i.e. the id, the node
+#: indexes and the material id for elements and the id and x, y, z
+#: coordinates for nodes.
+_3DM_CARDS = {b'e3t': 5, b'e4q': 6, b'e6t': 8, b'nd ': 4, b'ns ': None}
+
+#: Corner nodes of each element type, quadrilaterals are split into two
+#: triangles and 6-node triangles are reduced to their corner nodes
+_3DM_TRIANGLES = {b'e3t': [[0, 1, 2]], b'e4q': [[0, 1, 2], [0, 2, 3]],
+                  b'e6t': [[0, 2, 4]]}
+
+
+def _card_code(card):
+    return (card[0] << 16) | (card[1] << 8) | card[2]
+
+
+def _line_cards(buf, starts):
+    """
+    Classifies the lines beginning at the supplied byte offsets by
+    case-insensitively encoding their first three characters as an
+    integer, with any whitespace in the third character normalized to
+    a space.
+    """
+    chars = [np.take(buf, starts+i, mode='clip').astype(np.int32) | 0x20
+             for i in range(3)]
+    chars[2][np.isin(chars[2], [0x29, 0x2a, 0x2d])] = 0x20
+    return (chars[0] << 16) | (chars[1] << 8) | chars[2]
+
+
+def _line_runs(lines, chunksize):
+    """
+    Splits sorted line indexes into runs of consecutive lines no
+    longer than chunksize, returning the (start, stop) positions of
+    each run.
+    """
+    breaks = np.flatnonzero(np.diff(lines) != 1) + 1
+    bounds = np.concatenate([[0], breaks, [len(lines)]])
+    runs = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        runs += [(i, min(i+chunksize, stop)) for i in range(start, stop, chunksize)]
+    return runs
+
+
+def _parse_cards(buf, start, stop, ncols):
+    """
+    Parses the numeric columns of a block of whitespace delimited
+    card lines using the C parser in pandas.
+    """
+    return pd.read_csv(io.BytesIO(buf[start:stop].tobytes()), sep=r'\s+', header=None,
+                       usecols=list(range(1, ncols+1)), engine='c',
+                       na_filter=False).values
+
+
+def _parse_nodestrings(buf, starts, ends):
+    """
+    Parses NS cards into a list of node index arrays, each nodestring
+    is terminated by a negative node id.
+    """
+    nodestrings, current = [], []
+    for start, end in zip(starts, ends):
+        for token in buf[start:end].tobytes().split()[1:]:
+            try:
+                node = int(token)
+            except ValueError:
+                continue
+            current.append(abs(node)-1)
+            if node < 0:
+                nodestrings.append(np.array(current, dtype=np.int32))
+                current = []
+    return nodestrings
+
+
+def _parse_3dm(fpath, skiprows=1, chunksize=2**18):
+    """
+    Parses a 3DM file in a single classification pass, writing the
+    elements and nodes straight into preallocated arrays.
+    """
+    with open(fpath, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be memory-mapped
+            mm = b''
+    try:
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        starts = np.concatenate([[0], np.flatnonzero(buf == 10)+1])
+        if starts[-1] == len(buf):
+            starts = starts[:-1]
+        ends = np.append(starts[1:], len(buf))
+        starts, ends = starts[skiprows:], ends[skiprows:]
+
+        # Classify each line by its first non-blank characters,
+        # advancing all indented lines one character at a time
+        first = starts.copy()
+        indented = np.flatnonzero(np.isin(np.take(buf, first, mode='clip'), [9, 32]) &
+                                  (first < ends))
+        while len(indented):
+            first[indented] += 1
+            indented = indented[np.isin(np.take(buf, first[indented], mode='clip'), [9, 32]) &
+                                (first[indented] < ends[indented])]
+        cards = _line_cards(buf, first)
+
+        # Compute the output row of each element preserving file order
+        ntris = np.zeros(len(cards), dtype=np.int8)
+        for card, tris in _3DM_TRIANGLES.items():
+            ntris[cards == _card_code(card)] = len(tris)
+        offsets = np.cumsum(ntris, dtype=np.int64) - ntris
+
+        conns = np.empty((ntris.sum(), 4), dtype=np.int32)
+        nodes = np.flatnonzero(cards == _card_code(b'nd '))
+        pts = np.empty((len(nodes), 3), dtype=np.float64)
+
+        for card, tris in _3DM_TRIANGLES.items():
+            lines = np.flatnonzero(cards == _card_code(card))
+            ncols = _3DM_CARDS[card]
+            for i, j in _line_runs(lines, chunksize):
+                values = _parse_cards(buf, starts[lines[i]], ends[lines[j-1]], ncols)
+                row = offsets[lines[i]]
+                for k, corners in enumerate(tris):
+                    out = conns[row+k:row+(j-i)*len(tris):len(tris)]
+                    out[:, :3] = values[:, np.array(corners)+1] - 1
+                    out[:, 3] = values[:, -1] - 1
+
+        for i, j in _line_runs(nodes, chunksize):
+            pts[i:j] = _parse_cards(buf, starts[nodes[i]], ends[nodes[j-1]], 4)[:, 1:]
+
+        ns = np.flatnonzero(cards == _card_code(b'ns '))
+        nodestrings = _parse_nodestrings(buf, starts[ns], ends[ns])
+    finally:
+        del buf
+        if isinstance(mm, mmap.mmap):
+            mm.close()
+    return conns, pts, nodestrings
+
+
+def read_3dm_mesh(fpath, skiprows=1, cache=None, nodestrings=False, region=None):
     """
     Reads a 3DM mesh file and returns the simplices and vertices as dataframes
 
+    E3T, E4Q and E6T elements are supported, quadrilaterals are split
+    into two triangles and only the corner nodes of 6-node triangles
+    are retained.
+
+    If a region is supplied only the elements intersecting it and
+    their nodes are returned (see earthsim.mesh.subset_mesh). The
+    nodes are renumbered compactly while the index of the verts holds
+    their original zero-based ids, which may be passed to read_mesh2d
+    to select the matching results. Nodestrings are split wherever
+    they pass through nodes outside the region. Note that the whole
+    mesh is still parsed, so memory usage is not bounded by the
+    region.
+
     Parameters
     ----------
 
     fpath: str
          Path to 3dm file
+    cache: boolean or None
+         Whether to use the disk_cache, defaults to disk_cache.enabled
+    nodestrings: boolean
+         Whether to also return the nodestrings defined by NS cards
+    region: tuple, shapely geometry or HoloViews element
+         Bounding box as a (x0, y0, x1, y1) tuple or polygons to select
 
     Returns
     -------
@@ -97,59 +483,497 @@ def read_3dm_mesh(fpath, skiprows=1):
         Simplexes of the mesh
     verts: DataFrame
         Vertices of the mesh
+    nodestrings: list(np.ndarray)
+        Node indexes of each nodestring (only if nodestrings=True)
     """
-    all_df = pd.read_table(fpath, delim_whitespace=True, header=None, skiprows=skiprows,
-                           names=('row_type', 'cmp1', 'cmp2', 'cmp3', 'val'), index_col=1)
+    cache = disk_cache.enabled if cache is None else cache
+    entry = None
+    if cache:
+        key = disk_cache.key(fpath, reader='3dm', skiprows=skiprows)
+        entry = disk_cache.get(key)
+
+    if entry is None:
+        conns, pts, strings = _parse_3dm(fpath, skiprows)
+        if cache:
+            lengths = [len(s) for s in strings]
+            flat = np.concatenate(strings) if strings else np.array([], dtype=np.int32)
+            disk_cache.put(key, {'tris': conns, 'verts': pts, 'ns_nodes': flat,
+                                 'ns_offsets': np.cumsum([0]+lengths)})
+    else:
+        arrays, _ = entry
+        conns, pts = arrays['tris'], arrays['verts']
+        offsets = arrays['ns_offsets']
+        strings = [arrays['ns_nodes'][i:j] for i, j in zip(offsets[:-1], offsets[1:])]
 
-    conns = all_df[all_df['row_type'].str.lower() == 'e3t'][['cmp1', 'cmp2', 'cmp3', 'val']].values.astype(int) - 1
-    pts = all_df[all_df['row_type'].str.lower() == 'nd'][['cmp1', 'cmp2', 'cmp3']].values.astype(float)
     verts = pd.DataFrame(pts, columns=['x', 'y', 'z'])
     tris = pd.DataFrame(conns, columns=['v0', 'v1', 'v2', 'mat'])
-    
+    if region is not None:
+        tris, verts, nodes = subset_mesh(tris, verts, region)
+        verts.index = nodes
+        inverse = pd.Series(np.arange(len(nodes)), index=nodes)
+        pieces = []
+        for string in strings:
+            mapped = inverse.reindex(string).values
+            present = ~np.isnan(mapped)
+            # Split the nodestring wherever it leaves the region
+            breaks = np.flatnonzero(np.diff(present.astype(np.int8))) + 1
+            for piece, inside in zip(np.split(mapped, breaks), np.split(present, breaks)):
+                if len(piece) and inside[0]:
+                    pieces.append(piece.astype(np.int32))
+        strings = pieces
+    if nodestrings:
+        return tris, verts, strings
     return tris, verts
 
 
-def read_mesh2d(fpath):
+def _write_cards(f, fmt, arrays, chunksize):
     """
-    Loads a .dat file containing mesh2d data corresponding to a 3dm mesh.
+    Writes a block of card lines by applying a format string repeated
+    for each row to the flattened values of the row block at once,
+    streaming each block to the file.
+    """
+    nrows = len(arrays[0]) if arrays else 0
+    for i in range(0, nrows, chunksize):
+        j = min(i+chunksize, nrows)
+        block = np.column_stack([arr[i:j] for arr in arrays])
+        f.write((fmt*(j-i)) % tuple(block.ravel().tolist()))
+
+
+def write_3dm_mesh(fpath, tris, verts, nodestrings=None, name=None,
+                   float_format='%.6f', chunksize=2**16):
+    """
+    Writes a mesh to a 3DM file, the counterpart to read_3dm_mesh.
+
+    Cards are formatted in vectorized blocks of rows which are
+    streamed to disk, so the full text is never held in memory.
 
     Parameters
     ----------
 
     fpath: str
-        Path to .dat file
+        Path to 3dm file
+    tris: DataFrame or np.ndarray
+        Node indexes of each triangle and optionally the material
+        id, using the zero-based convention of read_3dm_mesh (missing
+        materials default to the first material)
+    verts: DataFrame, np.ndarray or gv.Points
+        Coordinates and optionally the elevation of each node, e.g.
+        the vert_points output by GenerateMesh
+    nodestrings: list(np.ndarray) or None
+        Zero-based node indexes of each nodestring, empty nodestrings
+        are skipped
+    name: str or None
+        Name of the mesh written to the MESHNAME card
+    float_format: str
+        Format of the node coordinates
+    chunksize: int
+        Number of cards formatted at once
+    """
+    if isinstance(verts, gv.Points):
+        verts = verts.dframe()
+    conns, mat, coords, z = _mesh_columns(tris, verts)
+    conns = conns.astype(np.int64) + 1
+    mat = np.ones(len(conns), dtype=np.int64) if mat is None else mat.astype(np.int64) + 1
+    z = np.zeros(len(coords)) if z is None else z
+    ids = np.arange(1, max(len(conns), len(coords))+1)
+
+    with open(fpath, 'w') as f:
+        f.write('MESH2D\n')
+        if name is not None:
+            f.write('MESHNAME "%s"\n' % name)
+        _write_cards(f, 'E3T %d %d %d %d %d\n', [ids[:len(conns)], conns[:, 0], conns[:, 1],
+                                                 conns[:, 2], mat], chunksize)
+        fmt = 'ND %%d %s %s %s\n' % ((float_format,)*3)
+        _write_cards(f, fmt, [ids[:len(coords)], coords[:, 0], coords[:, 1], z], chunksize)
+        for nodestring in (nodestrings or []):
+            nodes = np.asarray(nodestring, dtype=np.int64) + 1
+            if not len(nodes):
+                continue
+            nodes[-1] *= -1
+            for i in range(0, len(nodes), 10):
+                f.write('NS %s\n' % ' '.join(map(str, nodes[i:i+10].tolist())))
 
-    Returns
-    -------
 
-    dfs: dict(int: DataFrame)
-        A dictionary of dataframes indexed by time.
+def _index_mesh2d(fpath):
+    """
+    Scans a mesh2d .dat file once, parsing the header and recording
+    the time and the byte range of the node values of every TS card.
+    Returns the times, start and stop offsets, column names and the
+    number of nodes.
     """
-    attrs = {}
-    with open(fpath, 'r') as f:
+    with open(fpath, 'rb') as f:
         dataset = f.readline()
-        if not dataset.startswith('DATASET'):
+        if not dataset.startswith(b'DATASET'):
             raise ValueError('Expected DATASET file, cannot read data.')
         objtype = f.readline()
-        if not objtype.startswith('OBJTYPE "mesh2d"'):
+        if not objtype.startswith(b'OBJTYPE "mesh2d"'):
             raise ValueError('Expected "mesh2d" OBJTYPE, cannot read data.')
-        _ = f.readline()
-        nd, nc = f.readline(), f.readline()
-        name = f.readline()[6:-2]
-        unit = f.readline()
-    df = pd.read_table(fpath, delim_whitespace=True,
-                       header=None, skiprows=7, names=[0, 1, 2]).iloc[:-1]
-    ts_index = np.where(df[0]=='TS')[0]
-    indexes = [df.iloc[idx, 2] for idx in ts_index]
-    dfs = {}
-    for time, tdf in zip(indexes, np.split(df, ts_index)[1:]):
-        tdf = tdf.iloc[1:].astype(np.float64).dropna(axis=1, how='all')
-        if len(tdf.columns) == 1:
-            tdf.columns = [name]
+        header = {}
+        for line in iter(f.readline, b''):
+            if line.startswith(b'TS'):
+                break
+            card, _, value = line.decode('utf-8').strip().partition(' ')
+            header[card] = value.strip().strip('"')
+        name, nc = header.get('NAME', ''), int(header.get('NC', 0))
+        nd = int(header.get('ND', 0))
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = mm.rfind(b'\nENDDS')
+            end = len(mm) if end < 0 else end+1
+            times, starts, stops = [], [], []
+            nxt = mm.find(b'\nTS', 0, end)
+            while nxt >= 0:
+                pos = nxt + 1
+                eol = mm.find(b'\n', pos)
+                _, istat, time = mm[pos:eol].split()[:3]
+                start = eol + 1
+                if int(istat):
+                    # Skip the status flags of each element
+                    for _ in range(nc):
+                        start = mm.find(b'\n', start) + 1
+                nxt = mm.find(b'\nTS', start, end)
+                times.append(float(time))
+                starts.append(start)
+                stops.append(end if nxt < 0 else nxt+1)
+            ncols = len(mm[starts[0]:mm.find(b'\n', starts[0])].split()) if starts else 1
+            if starts and not nd:
+                nd = mm[starts[0]:stops[0]].count(b'\n')
+    columns = [name] if ncols == 1 else [name+'_%d' % c for c in range(ncols)]
+    return times, starts, stops, columns, nd
+
+
+class Mesh2DDataset(Mapping):
+    """
+    Lazy mapping from time to a DataFrame of the node values of a
+    mesh2d .dat file.
+
+    The node values of each timestep are only decoded when they are
+    accessed, either from the text file using an index of byte ranges
+    or from an array such as a memory-mapped cache entry, so memory
+    usage scales with a single timestep rather than the whole run.
+    """
+
+    def __init__(self, times, columns, fpath=None, ranges=None, data=None, nodes=None,
+                 node_index=None):
+        self.fpath = fpath
+        self.times = list(times)
+        self.columns = list(columns)
+        if node_index is not None:
+            node_index = np.asarray(node_index, dtype=np.int64)
+            nodes = len(node_index)
+        self.nodes = len(data[0]) if nodes is None and data is not None else nodes
+        self._ranges = ranges
+        self._data = data
+        self._node_index = node_index
+        self._index = {t: i for i, t in enumerate(self.times)}
+
+    def _decode(self, i):
+        if self._data is not None:
+            values = self._data[i]
         else:
-            tdf.columns = [name+'_%d' % c for c in range(len(tdf.columns))]
-        dfs[time] = tdf.reset_index(drop=True)
-    return dfs
+            start, stop = self._ranges[i]
+            with open(self.fpath, 'rb') as f:
+                f.seek(start)
+                buf = f.read(stop-start)
+            values = pd.read_csv(io.BytesIO(buf), sep=r'\s+', header=None, engine='c',
+                                 na_filter=False, dtype=np.float64).values
+        if self._node_index is not None:
+            values = values[self._node_index]
+        return np.asarray(values)
+
+    def _decode_block(self, start, stop):
+        return np.stack([self._decode(i) for i in range(start, stop)])
+
+    def __getitem__(self, time):
+        data = self._decode(self._index[time])
+        return pd.DataFrame(data, columns=self.columns)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return '%s(%r, times=%d, columns=%r)' % (
+            type(self).__name__, self.fpath, len(self), self.columns)
+
+    def select_nodes(self, index):
+        """
+        Returns a new dataset which lazily selects the supplied node
+        indexes from each timestep, e.g. to reorder the nodes to match
+        a mesh renumbered by renumber_mesh.
+        """
+        index = np.asarray(index, dtype=np.int64)
+        if self._node_index is not None:
+            index = self._node_index[index]
+        return type(self)(self.times, self.columns, self.fpath, self._ranges,
+                          self._data, node_index=index)
+
+    def _stack(self, chunks=1):
+        """
+        Returns a dask array of shape (time, node, column) where each
+        chunk of timesteps is decoded independently.
+        """
+        shape = (self.nodes, len(self.columns))
+        if self._data is not None:
+            arr = da.from_array(self._data, chunks=(chunks,)+self._data.shape[1:])
+            return arr if self._node_index is None else arr[:, self._node_index]
+        decode = dask.delayed(self._decode_block, pure=True)
+        blocks = []
+        for i in range(0, len(self.times), chunks):
+            j = min(i+chunks, len(self.times))
+            blocks.append(da.from_delayed(decode(i, j), (j-i,)+shape, dtype=np.float64))
+        if not blocks:
+            return da.zeros((0,)+shape, dtype=np.float64, chunks=(1,)+shape)
+        return da.concatenate(blocks)
+
+    def to_dask(self, chunks=1):
+        """
+        Returns a dask array of shape (time, node) for scalar datasets
+        or (time, node, component) for vector datasets. Each chunk
+        parses its own byte range of the file so chunks may be decoded
+        concurrently; since parsing holds the GIL for part of the time
+        the multiprocessing scheduler will usually scale best.
+
+        Parameters
+        ----------
+
+        chunks: int
+            Number of timesteps per chunk
+
+        Examples
+        --------
+
+        Decode the timesteps in parallel worker processes:
+
+            arr = dataset.to_dask(chunks=10)
+            peak = arr.max(axis=0).compute(scheduler='processes')
+        """
+        arr = self._stack(chunks)
+        return arr[..., 0] if len(self.columns) == 1 else arr
+
+
+def read_mesh2d(fpath, cache=None, chunks=None, nodes=None):
+    """
+    Loads a .dat file containing mesh2d data corresponding to a 3dm mesh.
+
+    The file is scanned once to index the TS cards and each timestep
+    is only decoded when it is accessed, so memory and time scale with
+    the timesteps that are used. If the disk cache is used the first
+    read instead decodes every timestep into the cache, one chunk at a
+    time, and subsequent reads memory-map it. This only pays off when
+    the whole run is loaded repeatedly.
+
+    To load the results of a region of the mesh, supply the original
+    node ids of a mesh read with a region, e.g.:
+
+        tris, verts = read_3dm_mesh(mesh_path, region=bbox)
+        dfs = read_mesh2d(dat_path, nodes=verts.index)
+
+    Parameters
+    ----------
+
+    fpath: str
+        Path to .dat file
+    cache: boolean or None
+        Whether to use the disk_cache, defaults to disk_cache.enabled
+    chunks: int or None
+        If supplied a dask array of shape (time, node[, component])
+        with the specified number of timesteps per chunk is returned
+        (see Mesh2DDataset.to_dask). Unless the disk cache is used,
+        each chunk is decoded independently when computed, so e.g.
+        arr.compute(scheduler='processes') decodes the chunks in
+        parallel. If the disk cache is used the chunks are decoded
+        into the cache on the threaded scheduler when the file is
+        first read and the returned array memory-maps the cache.
+    nodes: array-like or None
+        Zero-based indexes of the nodes to select
+
+    Returns
+    -------
+
+    dfs: Mesh2DDataset or dask.array.Array
+        A lazy mapping of dataframes indexed by time.
+    """
+    cache = disk_cache.enabled if cache is None else cache
+    if cache:
+        key = disk_cache.key(fpath, reader='mesh2d')
+        entry = disk_cache.get(key)
+        if entry is not None:
+            arrays, attrs = entry
+            dataset = Mesh2DDataset(arrays['times'], attrs['columns'], fpath,
+                                    data=arrays['data'], node_index=nodes)
+            return dataset if chunks is None else dataset.to_dask(chunks)
+
+    times, starts, stops, columns, nd = _index_mesh2d(fpath)
+    ranges = list(zip(starts, stops))
+    dataset = Mesh2DDataset(times, columns, fpath, ranges, nodes=nd, node_index=nodes)
+    if cache and times:
+        full = Mesh2DDataset(times, columns, fpath, ranges, nodes=nd)
+        entry = disk_cache.put(key, {'times': np.array(times, dtype=np.float64),
+                                     'data': full._stack(chunks or 1)},
+                               {'columns': columns})
+        if entry is not None:
+            dataset = Mesh2DDataset(times, columns, fpath, data=entry[0]['data'],
+                                    node_index=nodes)
+    return dataset if chunks is None else dataset.to_dask(chunks)
+
+
+def _mesh_columns(tris, verts):
+    """
+    Returns the connectivity, material, coordinate and elevation
+    arrays of a mesh supplied as dataframes or arrays, with None for
+    the material and elevation if they are not defined.
+    """
+    if isinstance(tris, pd.DataFrame):
+        mat = tris['mat'].values if 'mat' in tris.columns else None
+        tris = tris[['v0', 'v1', 'v2']].values
+    else:
+        tris = np.asarray(tris)
+        mat = tris[:, 3] if tris.shape[1] > 3 else None
+    if isinstance(verts, pd.DataFrame):
+        z = verts['z'].values if 'z' in verts.columns else None
+        verts = verts[['x', 'y']].values
+    else:
+        verts = np.asarray(verts)
+        z = verts[:, 2] if verts.shape[1] > 2 else None
+    return tris[:, :3], mat, verts[:, :2], z
+
+
+def write_ugrid(fpath, tris, verts, results=None, complevel=4, chunks=2**16, time_chunks=1):
+    """
+    Writes a mesh and optionally the time-varying node results of a
+    simulation to a compressed NetCDF file following the UGRID
+    conventions, storing the node coordinates, face connectivity,
+    material ids and each result column as chunked, compressed
+    variables. Results are streamed to disk one chunk of timesteps at
+    a time.
+
+    Parameters
+    ----------
+
+    fpath: str
+        Path to the NetCDF file
+    tris: DataFrame or np.ndarray
+        Node indexes of each triangle and optionally the material id
+    verts: DataFrame or np.ndarray
+        Coordinates and optionally the elevation of each node
+    results: Mesh2DDataset or list(Mesh2DDataset)
+        Node results as returned by read_mesh2d, all datasets must
+        share the same times and have distinct column names
+    complevel: int
+        zlib compression level
+    chunks: int
+        Number of nodes or faces per chunk
+    time_chunks: int
+        Number of timesteps per chunk
+    """
+    conns, mat, coords, z = _mesh_columns(tris, verts)
+    node_vars = ['node_x', 'node_y'] + (['node_z'] if z is not None else [])
+    face_vars = ['face_material'] if mat is not None else []
+    ds = xr.Dataset({
+        'mesh': ((), 0, {'cf_role': 'mesh_topology', 'topology_dimension': 2,
+                         'node_coordinates': 'node_x node_y',
+                         'face_node_connectivity': 'face_nodes'}),
+        'node_x': (('node',), coords[:, 0], {'standard_name': 'projection_x_coordinate'}),
+        'node_y': (('node',), coords[:, 1], {'standard_name': 'projection_y_coordinate'}),
+        'face_nodes': (('face', 'max_face_nodes'), conns.astype(np.int32),
+                       {'cf_role': 'face_node_connectivity', 'start_index': 0})
+    })
+    if z is not None:
+        ds['node_z'] = (('node',), z, {'mesh': 'mesh', 'location': 'node'})
+    if mat is not None:
+        ds['face_material'] = (('face',), mat.astype(np.int32), {'mesh': 'mesh', 'location': 'face'})
+
+    nnodes, nfaces = max(len(coords), 1), max(len(conns), 1)
+    encoding = {var: {'zlib': True, 'complevel': complevel,
+                      'chunksizes': (min(chunks, nnodes),)} for var in node_vars}
+    encoding.update({var: {'zlib': True, 'complevel': complevel,
+                           'chunksizes': (min(chunks, nfaces),)} for var in face_vars})
+    encoding['face_nodes'] = {'zlib': True, 'complevel': complevel,
+                              'chunksizes': (min(chunks, nfaces), 3)}
+
+    if results is not None:
+        results = results if isinstance(results, list) else [results]
+        times = results[0].times if results else []
+        for dataset in results:
+            if list(dataset.times) != list(times):
+                raise ValueError('All results written to a UGRID file must '
+                                 'share the same times.')
+            stacked = dataset._stack(time_chunks)
+            for c, column in enumerate(dataset.columns):
+                if column in ds:
+                    raise ValueError('Result column %r clashes with another variable '
+                                     'written to the UGRID file, rename the columns '
+                                     'of one of the datasets.' % column)
+                ds[column] = (('time', 'node'), stacked[..., c], {'mesh': 'mesh', 'location': 'node'})
+                encoding[column] = {'zlib': True, 'complevel': complevel,
+                                    'chunksizes': (max(min(time_chunks, len(times)), 1),
+                                                   min(chunks, nnodes))}
+        ds = ds.assign_coords(time=np.array(times, dtype=np.float64))
+    ds.to_netcdf(fpath, encoding=encoding, engine='netcdf4')
+
+
+def read_ugrid(fpath, region=None, times=None, chunks=None):
+    """
+    Reads a mesh and its node results from a UGRID NetCDF file, such
+    as one written by write_ugrid. The node results are read lazily
+    and may be restricted to a subset of times and to the nodes of the
+    elements intersecting a region, in which case only the selected
+    results are read from disk. The node coordinates and face
+    connectivity of the whole mesh are always read in full, since they
+    are required to select the elements within the region.
+
+    Parameters
+    ----------
+
+    fpath: str
+        Path to the NetCDF file
+    region: tuple, shapely geometry, HoloViews element or None
+        Bounding box as a (x0, y0, x1, y1) tuple or polygons, selecting
+        the elements intersecting it and renumbering their nodes
+        compactly (see earthsim.mesh.subset_mesh)
+    times: slice, list or None
+        Times to select from the results
+    chunks: int or None
+        If supplied the results are returned as dask arrays with the
+        specified number of timesteps per chunk
+
+    Returns
+    -------
+
+    tris: DataFrame
+        Simplexes of the mesh
+    verts: DataFrame
+        Vertices of the mesh
+    results: xr.Dataset
+        Node results indexed by time and node
+    """
+    ds = xr.open_dataset(fpath, chunks=None if chunks is None else {'time': chunks},
+                         engine='netcdf4')
+    topology = [v for v in ds.variables.values() if v.attrs.get('cf_role') == 'mesh_topology'][0]
+    xvar, yvar = topology.attrs['node_coordinates'].split()[:2]
+    face_var = ds[topology.attrs['face_node_connectivity']]
+    conns = face_var.values.astype(np.int64) - int(face_var.attrs.get('start_index', 0))
+    node_dim = ds[xvar].dims[0]
+
+    tris = pd.DataFrame(conns[:, :3], columns=['v0', 'v1', 'v2'])
+    mat = [v for v in ds.data_vars if v.endswith('material') and ds[v].dims == face_var.dims[:1]]
+    if mat:
+        tris['mat'] = ds[mat[0]].values
+    verts = pd.DataFrame({'x': ds[xvar].values, 'y': ds[yvar].values}, columns=['x', 'y'])
+    if 'node_z' in ds:
+        verts['z'] = ds['node_z'].values
+
+    results = ds[[v for v, var in ds.data_vars.items() if var.attrs.get('location') == 'node'
+                  and 'time' in var.dims and node_dim in var.dims]]
+    if times is not None:
+        results = results.sel(time=times)
+    if region is not None:
+        tris, verts, nodes = subset_mesh(tris, verts, region)
+        results = results.isel({node_dim: nodes})
+    return tris, verts, results
 
 
 def save_shapefile(cdsdata, path, template):
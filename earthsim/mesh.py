@@ -0,0 +1,462 @@
+"""
+Utilities for working with unstructured triangular meshes.
+"""
+
+import hashlib
+
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from shapely.geometry import Polygon
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
+from shapely.prepared import prep
+
+try:
+    from shapely import intersects, polygons
+except ImportError:
+    # Shapely < 2.0 has no vectorized predicates
+    intersects = polygons = None
+
+
+class TriangleIndex(object):
+    """
+    Spatial index over the triangles of a mesh, which bins the
+    bounding box of each triangle into a uniform grid with roughly as
+    many cells as there are triangles. Supports batched point location
+    returning the containing triangle and the barycentric weights of
+    each point, which may be used to interpolate node values.
+
+    Parameters
+    ----------
+
+    verts: np.ndarray
+        Array of shape (N, 2+) of the node coordinates
+    tris: np.ndarray
+        Array of shape (M, 3+) of the node indexes of each triangle
+    """
+
+    def __init__(self, verts, tris):
+        self.verts = np.asarray(verts, dtype=np.float64)[:, :2]
+        self.tris = np.asarray(tris)[:, :3].astype(np.int64)
+        pts = self.verts[self.tris]
+        lo, hi = pts.min(axis=1), pts.max(axis=1)
+
+        # Declare a grid with roughly one cell per triangle
+        ntris = max(len(self.tris), 1)
+        (x0, y0), (x1, y1) = lo.min(axis=0), hi.max(axis=0)
+        width, height = max(x1-x0, 1e-12), max(y1-y0, 1e-12)
+        size = np.sqrt(width*height/ntris)
+        self.shape = (int(min(np.ceil(height/size), ntris)) or 1,
+                      int(min(np.ceil(width/size), ntris)) or 1)
+        self.bounds = (x0, y0, x1, y1)
+        self._cell_size = (width/self.shape[1], height/self.shape[0])
+
+        # Assign each triangle to all cells its bounding box overlaps
+        (ix0, iy0), (ix1, iy1) = self._cells(*lo.T), self._cells(*hi.T)
+        nx, ny = ix1-ix0+1, iy1-iy0+1
+        counts = nx*ny
+        tri_ids = np.repeat(np.arange(len(self.tris)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts, counts)
+        cells = ((iy0[tri_ids] + offset // nx[tri_ids]) * self.shape[1] +
+                 ix0[tri_ids] + offset % nx[tri_ids])
+        order = np.argsort(cells, kind='mergesort')
+        self._cell_tris = tri_ids[order]
+        self._cell_start = np.concatenate([[0], np.cumsum(
+            np.bincount(cells, minlength=self.shape[0]*self.shape[1]))])
+
+        # Precompute the affine transform of each triangle
+        self._origin = pts[:, 0]
+        self._edges = np.stack([pts[:, 1]-pts[:, 0], pts[:, 2]-pts[:, 0]], axis=1)
+        self._det = (self._edges[:, 0, 0]*self._edges[:, 1, 1] -
+                     self._edges[:, 1, 0]*self._edges[:, 0, 1])
+
+    def _cells(self, xs, ys):
+        """
+        Returns the (clipped) column and row of the grid cells
+        containing the supplied coordinates.
+        """
+        x0, y0, _, _ = self.bounds
+        cw, ch = self._cell_size
+        cx = np.clip(np.floor((xs-x0)/cw), 0, self.shape[1]-1).astype(np.int64)
+        cy = np.clip(np.floor((ys-y0)/ch), 0, self.shape[0]-1).astype(np.int64)
+        return cx, cy
+
+    def _barycentric(self, tri_ids, xs, ys):
+        dx = xs - self._origin[tri_ids, 0]
+        dy = ys - self._origin[tri_ids, 1]
+        edges, det = self._edges[tri_ids], self._det[tri_ids]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w1 = (dx*edges[:, 1, 1] - edges[:, 1, 0]*dy) / det
+            w2 = (edges[:, 0, 0]*dy - dx*edges[:, 0, 1]) / det
+        return np.column_stack([1-w1-w2, w1, w2])
+
+    def query(self, xs, ys, tolerance=1e-9, chunksize=2**20):
+        """
+        Locates the triangles containing the supplied points.
+
+        Parameters
+        ----------
+
+        xs: np.ndarray
+            x-coordinates of the points
+        ys: np.ndarray
+            y-coordinates of the points
+        tolerance: float
+            Tolerance on the barycentric weights when testing whether a
+            point lies within a triangle
+        chunksize: int
+            Maximum number of points to locate at once
+
+        Returns
+        -------
+
+        tri_ids: np.ndarray
+            Index of the triangle containing each point or -1
+        weights: np.ndarray
+            Array of shape (N, 3) of the barycentric weights of each
+            point, NaN for points outside the mesh
+        """
+        xs = np.asarray(xs, dtype=np.float64).ravel()
+        ys = np.asarray(ys, dtype=np.float64).ravel()
+        tri_ids = np.full(len(xs), -1, dtype=np.int64)
+        weights = np.full((len(xs), 3), np.nan)
+        x0, y0, x1, y1 = self.bounds
+        for i in range(0, len(xs), chunksize):
+            cxs, cys = xs[i:i+chunksize], ys[i:i+chunksize]
+            points = np.flatnonzero((cxs >= x0) & (cxs <= x1) & (cys >= y0) & (cys <= y1))
+            cx, cy = self._cells(cxs[points], cys[points])
+            cells = cy*self.shape[1] + cx
+
+            # Test each point against every triangle in its cell
+            start = self._cell_start[cells]
+            counts = self._cell_start[cells+1] - start
+            pair_pts = np.repeat(points, counts)
+            offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts, counts)
+            pair_tris = self._cell_tris[np.repeat(start, counts) + offset]
+            pair_weights = self._barycentric(pair_tris, cxs[pair_pts], cys[pair_pts])
+            valid = np.flatnonzero((pair_weights >= -tolerance).all(axis=1))
+
+            # Pick the first containing triangle of each point
+            _, first = np.unique(pair_pts[valid], return_index=True)
+            found = valid[first]
+            tri_ids[i+pair_pts[found]] = pair_tris[found]
+            weights[i+pair_pts[found]] = pair_weights[found]
+        return tri_ids, weights
+
+    def interpolate(self, values, xs, ys):
+        """
+        Interpolates node values at the supplied points using the
+        barycentric weights of the containing triangles.
+
+        Parameters
+        ----------
+
+        values: np.ndarray
+            Array of node values, with the nodes along the first axis
+        xs: np.ndarray
+            x-coordinates of the points
+        ys: np.ndarray
+            y-coordinates of the points
+
+        Returns
+        -------
+
+        samples: np.ndarray
+            Interpolated values with the points along the first axis,
+            NaN for points outside the mesh
+        """
+        values = np.asarray(values, dtype=np.float64)
+        tri_ids, weights = self.query(xs, ys)
+        found = tri_ids >= 0
+        samples = np.full((len(tri_ids),)+values.shape[1:], np.nan)
+        nodes = self.tris[tri_ids[found]]
+        weights = weights[found].reshape(weights[found].shape+(1,)*(values.ndim-1))
+        samples[found] = (values[nodes]*weights).sum(axis=1)
+        return samples
+
+
+def _mesh_arrays(tris, verts):
+    """
+    Returns the triangle connectivity and vertex coordinates of a mesh
+    supplied as arrays or as the dataframes returned by read_3dm_mesh
+    and xmsmesh_to_dataframe.
+    """
+    if isinstance(tris, pd.DataFrame):
+        cols = ['v0', 'v1', 'v2'] if 'v0' in tris.columns else tris.columns[:3]
+        tris = tris[cols].values
+    if isinstance(verts, pd.DataFrame):
+        cols = ['x', 'y'] if 'x' in verts.columns else verts.columns[:2]
+        verts = verts[cols].values
+    return np.asarray(tris)[:, :3], np.asarray(verts)[:, :2]
+
+
+def _array_hash(*arrays):
+    """
+    Hashes the shape, dtype and contents of the supplied arrays.
+    """
+    h = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(repr((arr.shape, arr.dtype.str)).encode('utf-8'))
+        h.update(arr.view(np.uint8))
+    return h.hexdigest()
+
+
+_index_cache = OrderedDict()
+
+def triangle_index(tris, verts, cache_size=8):
+    """
+    Returns a TriangleIndex for the supplied mesh, reusing a
+    previously built index as long as the connectivity and vertex
+    arrays have not changed. The arrays are compared by content, so
+    the index is rebuilt if they are modified in place.
+
+    Parameters
+    ----------
+
+    tris: DataFrame or np.ndarray
+        Node indexes of each triangle
+    verts: DataFrame or np.ndarray
+        Coordinates of each node
+    cache_size: int
+        Maximum number of indexes to keep cached
+
+    Returns
+    -------
+
+    index: TriangleIndex
+    """
+    tris, verts = _mesh_arrays(tris, verts)
+    key = _array_hash(tris, verts)
+    if key in _index_cache:
+        _index_cache.move_to_end(key)
+        return _index_cache[key]
+    index = TriangleIndex(verts, tris)
+    _index_cache[key] = index
+    while len(_index_cache) > cache_size:
+        _index_cache.popitem(last=False)
+    return index
+
+
+def _hilbert_index(xs, ys, order=16):
+    """
+    Computes the distance of each point along a Hilbert curve covering
+    the bounding box of the points, quantized to a 2**order by 2**order
+    grid.
+    """
+    n = 2**order
+    xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    span = max(xs.max()-xs.min(), ys.max()-ys.min(), 1e-12)
+    x = np.minimum(((xs-xs.min())/span*n).astype(np.int64), n-1)
+    y = np.minimum(((ys-ys.min())/span*n).astype(np.int64), n-1)
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve is continuous
+        flip = ~ry & rx
+        x = np.where(flip, n-1-x, x)
+        y = np.where(flip, n-1-y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s //= 2
+    return d
+
+
+def _rcm_order(tris, n):
+    """
+    Computes the reverse Cuthill-McKee ordering of the nodes of a mesh.
+    """
+    try:
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import reverse_cuthill_mckee
+    except ImportError:
+        raise ImportError("Reverse Cuthill-McKee renumbering requires scipy, "
+                          "install it or use method='hilbert'.")
+    rows = np.concatenate([tris[:, 0], tris[:, 1], tris[:, 2]])
+    cols = np.concatenate([tris[:, 1], tris[:, 2], tris[:, 0]])
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n)).tocsr()
+    return np.asarray(reverse_cuthill_mckee(graph, symmetric_mode=True), dtype=np.int64)
+
+
+def _select_elements(tris, elements, conns):
+    """
+    Selects the supplied elements of a mesh, replacing their node
+    indexes with the supplied connectivity while retaining any
+    additional columns.
+    """
+    if isinstance(tris, pd.DataFrame):
+        cols = ['v0', 'v1', 'v2'] if 'v0' in tris.columns else list(tris.columns[:3])
+        tris = tris.iloc[elements].reset_index(drop=True)
+        for i, col in enumerate(cols):
+            tris[col] = conns[:, i].astype(tris[col].dtype)
+    else:
+        tris = np.array(tris)[elements]
+        tris[:, :3] = conns
+    return tris
+
+
+def renumber_mesh(tris, verts, method='rcm'):
+    """
+    Renumbers the nodes and elements of a mesh to improve the memory
+    locality of operations gathering node values by element, such as
+    rasterizing, interpolation and solvers. Nodes are either ordered
+    using the reverse Cuthill-McKee algorithm, which minimizes the
+    bandwidth of the connectivity (requires scipy), or along a Hilbert
+    curve, which keeps spatially close nodes close in memory. The
+    elements are then sorted by their lowest node index.
+
+    Any results defined on the nodes of the original mesh may be
+    reordered to match using remap_nodes with the returned order.
+
+    Parameters
+    ----------
+
+    tris: DataFrame or np.ndarray
+        Node indexes of each triangle, additional columns such as the
+        material are reordered along with the elements
+    verts: DataFrame or np.ndarray
+        Coordinates of each node
+    method: str
+        Node ordering, either 'rcm' or 'hilbert'
+
+    Returns
+    -------
+
+    tris: DataFrame or np.ndarray
+        Renumbered and reordered elements
+    verts: DataFrame or np.ndarray
+        Reordered nodes
+    order: np.ndarray
+        Original index of each node in the renumbered mesh
+    """
+    conns, coords = _mesh_arrays(tris, verts)
+    conns = conns.astype(np.int64)
+    if method == 'rcm':
+        order = _rcm_order(conns, len(coords))
+    elif method == 'hilbert':
+        order = np.argsort(_hilbert_index(coords[:, 0], coords[:, 1]), kind='mergesort')
+    else:
+        raise ValueError("Unknown renumbering method %r, expected 'rcm' "
+                         "or 'hilbert'." % method)
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    conns = inverse[conns]
+    elements = np.argsort(conns.min(axis=1), kind='mergesort')
+    tris = _select_elements(tris, elements, conns[elements])
+    return tris, remap_nodes(verts, order), order
+
+
+def remap_nodes(data, order, axis=0):
+    """
+    Reorders data defined on the nodes of a mesh to match a mesh
+    renumbered by renumber_mesh.
+
+    Parameters
+    ----------
+
+    data: DataFrame, Mesh2DDataset, Mapping, np.ndarray or dask array
+        Node data, for DataFrames the nodes are the rows, the
+        Mesh2DDataset returned by read_mesh2d is remapped lazily, for
+        other Mappings each value is remapped and for arrays the nodes
+        are along the supplied axis, e.g. axis=1 for the arrays
+        returned by read_mesh2d with chunks
+    order: np.ndarray
+        Original index of each node as returned by renumber_mesh
+    axis: int
+        Axis of array data along which the nodes are laid out
+
+    Returns
+    -------
+
+    remapped: DataFrame, Mesh2DDataset, OrderedDict or array
+        The reordered node data
+    """
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[order].reset_index(drop=True)
+    elif hasattr(data, 'select_nodes'):
+        return data.select_nodes(order)
+    elif isinstance(data, Mapping):
+        return OrderedDict([(k, remap_nodes(v, order, axis)) for k, v in data.items()])
+    index = (slice(None),)*axis + (order,)
+    return data[index]
+
+
+def _region_geometry(region):
+    """
+    Converts a region supplied as a HoloViews Polygons or Path element
+    to a shapely geometry, returning bounding box tuples and shapely
+    geometries unchanged.
+    """
+    if isinstance(region, BaseGeometry) or not hasattr(region, 'split'):
+        return region
+    polys = [Polygon(arr[:, :2]) for arr in region.split(datatype='array') if len(arr) > 2]
+    return unary_union(polys)
+
+
+def subset_mesh(tris, verts, region):
+    """
+    Selects the elements of a mesh intersecting a region along with
+    the nodes they reference, renumbering the nodes compactly. For
+    bounding box regions all elements whose bounds overlap the box are
+    selected, for polygon regions all elements intersecting the
+    polygon.
+
+    Parameters
+    ----------
+
+    tris: DataFrame or np.ndarray
+        Node indexes of each triangle, additional columns such as the
+        material are retained
+    verts: DataFrame or np.ndarray
+        Coordinates of each node
+    region: tuple, shapely geometry or HoloViews element
+        Region as a (x0, y0, x1, y1) tuple, a shapely (Multi)Polygon or
+        a Polygons element, e.g. the poly_stream.element of an
+        annotator
+
+    Returns
+    -------
+
+    tris: DataFrame or np.ndarray
+        Selected elements referencing the renumbered nodes
+    verts: DataFrame or np.ndarray
+        Selected nodes
+    nodes: np.ndarray
+        Original index of each selected node, which may be used to
+        select matching node results
+    """
+    conns, coords = _mesh_arrays(tris, verts)
+    conns = conns.astype(np.int64)
+    geom = _region_geometry(region)
+    if not isinstance(geom, BaseGeometry):
+        x0, y0, x1, y1 = geom
+    elif geom.is_empty:
+        x0, y0, x1, y1 = np.inf, np.inf, -np.inf, -np.inf
+    else:
+        x0, y0, x1, y1 = geom.bounds
+    xs, ys = coords[:, 0][conns], coords[:, 1][conns]
+    elements = np.flatnonzero((xs.max(axis=1) >= x0) & (xs.min(axis=1) <= x1) &
+                              (ys.max(axis=1) >= y0) & (ys.min(axis=1) <= y1))
+
+    if isinstance(geom, BaseGeometry) and len(elements):
+        # Test the elements overlapping the bounds against the polygon
+        triangles = coords[conns[elements], :2]
+        if intersects is not None:
+            selected = intersects(geom, polygons(triangles))
+        else:
+            prepared = prep(geom)
+            selected = np.array([prepared.intersects(Polygon(t)) for t in triangles],
+                                dtype=bool)
+        elements = elements[selected]
+
+    nodes = np.unique(conns[elements])
+    inverse = np.full(len(coords), -1, dtype=np.int64)
+    inverse[nodes] = np.arange(len(nodes))
+    tris = _select_elements(tris, elements, inverse[conns[elements]])
+    return tris, remap_nodes(verts, nodes), nodes
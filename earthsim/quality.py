@@ -0,0 +1,119 @@
+"""
+Vectorized element quality metrics for triangular meshes.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .mesh import _mesh_arrays
+
+
+def _validate_mesh(verts, cells, func):
+    """
+    Returns the triangle and coordinate arrays of a mesh, raising an
+    error if the verts and cells appear to have been supplied in the
+    wrong order or the cells refer to nodes which do not exist.
+    """
+    if ((isinstance(verts, pd.DataFrame) and 'v0' in verts.columns) or
+        (isinstance(cells, pd.DataFrame) and 'x' in cells.columns)):
+        raise ValueError('%s takes the verts followed by the cells, the '
+                         'supplied frames appear to be swapped.' % func)
+    tris, coords = _mesh_arrays(cells, verts)
+    if len(tris) and (not np.array_equal(tris, np.round(tris)) or
+                      tris.min() < 0 or tris.max() >= len(coords)):
+        raise ValueError('%s takes the verts followed by the cells, the cells '
+                         'refer to nodes which are not among the %d verts.'
+                         % (func, len(coords)))
+    return tris.astype(np.int64), coords
+
+
+def mesh_quality(verts, cells):
+    """
+    Computes quality metrics for each triangle of a mesh, i.e. the
+    area, the lengths of the three edges, the minimum and maximum
+    interior angle (in degrees) and the aspect ratio, defined as the
+    ratio of the circumradius to twice the inradius, which is 1 for
+    an equilateral triangle and grows without bound as the triangle
+    degenerates.
+
+    The returned DataFrame includes the node indexes of each triangle
+    so it may be used directly to color a TriMesh, e.g.:
+
+        quality = mesh_quality(verts, cells)
+        gv.TriMesh((quality, gv.Points(verts)), vdims=['min_angle'])
+
+    Parameters
+    ----------
+
+    verts: DataFrame or np.ndarray
+        Coordinates of each node
+    cells: DataFrame or np.ndarray
+        Node indexes of each triangle
+
+    Returns
+    -------
+
+    quality: DataFrame
+        DataFrame with the v0, v1, v2, area, edge0, edge1, edge2,
+        min_angle, max_angle and aspect_ratio of each triangle, where
+        edgeN is the edge opposite node vN
+    """
+    tris, verts = _validate_mesh(verts, cells, 'mesh_quality')
+    verts = verts.astype(np.float64)
+    x, y = verts[:, 0], verts[:, 1]
+    x0, x1, x2 = x[tris[:, 0]], x[tris[:, 1]], x[tris[:, 2]]
+    y0, y1, y2 = y[tris[:, 0]], y[tris[:, 1]], y[tris[:, 2]]
+
+    area = np.abs((x1-x0)*(y2-y0) - (x2-x0)*(y1-y0))/2.
+    a = np.hypot(x2-x1, y2-y1)
+    b = np.hypot(x2-x0, y2-y0)
+    c = np.hypot(x1-x0, y1-y0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Law of cosines for the angle opposite each edge
+        angles = np.degrees(np.arccos(np.clip(np.column_stack([
+            (b**2+c**2-a**2)/(2*b*c),
+            (a**2+c**2-b**2)/(2*a*c),
+            (a**2+b**2-c**2)/(2*a*b)
+        ]), -1, 1)))
+        s = (a+b+c)/2.
+        aspect = (a*b*c)/(8*(s-a)*(s-b)*(s-c))
+    aspect[area == 0] = np.inf
+
+    return pd.DataFrame({
+        'v0': tris[:, 0], 'v1': tris[:, 1], 'v2': tris[:, 2],
+        'area': area, 'edge0': a, 'edge1': b, 'edge2': c,
+        'min_angle': angles.min(axis=1), 'max_angle': angles.max(axis=1),
+        'aspect_ratio': aspect
+    }, columns=['v0', 'v1', 'v2', 'area', 'edge0', 'edge1', 'edge2',
+                'min_angle', 'max_angle', 'aspect_ratio'])
+
+
+def node_valence(verts, cells):
+    """
+    Computes the valence of each node of a triangular mesh, i.e. the
+    number of distinct edges connected to it. Nodes not referenced by
+    any triangle have a valence of zero.
+
+    Parameters
+    ----------
+
+    verts: DataFrame or np.ndarray
+        Coordinates of each node
+    cells: DataFrame or np.ndarray
+        Node indexes of each triangle
+
+    Returns
+    -------
+
+    valence: pd.Series
+        Valence of each node, indexed like the verts
+    """
+    index = verts.index if isinstance(verts, pd.DataFrame) else None
+    tris, verts = _validate_mesh(verts, cells, 'node_valence')
+    n = len(verts)
+    edges = np.concatenate([tris[:, [0, 1]], tris[:, [1, 2]], tris[:, [2, 0]]])
+    edges.sort(axis=1)
+    edges = np.unique(edges[:, 0]*n + edges[:, 1])
+    valence = np.bincount(edges // n, minlength=n) + np.bincount(edges % n, minlength=n)
+    return pd.Series(valence, index=index, name='valence')
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import holoviews as hv
+import geoviews as gv
+
+from shapely.geometry import LineString, MultiLineString
+
+import earthsim.analysis as analysis
+
+from earthsim.analysis import (
+    LineCrossSection, SurfaceCrossSection, interpolate_line, _nearest_index
+)
+
+
+line_coords = np.array([[0, 0], [3, 4], [3, 4], [10, 4], [10, 0]], dtype=float)
+
+
+def test_interpolate_line_matches_shapely():
+    geom = LineString(line_coords)
+    distance = np.linspace(0, geom.length, 37)
+    xs, ys = interpolate_line([line_coords], distance)
+    expected = np.array([geom.interpolate(d).coords[0] for d in distance])
+    np.testing.assert_allclose(xs, expected[:, 0])
+    np.testing.assert_allclose(ys, expected[:, 1])
+
+
+def test_interpolate_multi_line_matches_shapely():
+    parts = [line_coords[:2], line_coords[3:]]
+    geom = MultiLineString(parts)
+    distance = np.linspace(0, geom.length, 23)
+    xs, ys = interpolate_line(parts, distance)
+    expected = np.array([geom.interpolate(d).coords[0] for d in distance])
+    np.testing.assert_allclose(xs, expected[:, 0])
+    np.testing.assert_allclose(ys, expected[:, 1])
+
+
+def test_nearest_index():
+    coords = np.array([0.5, 1.5, 2.5, 3.5])
+    values = np.array([-1, 0.9, 1.1, 2.0, 3.4, 10])
+    np.testing.assert_array_equal(_nearest_index(coords, values), [0, 0, 1, 1, 3, 3])
+    np.testing.assert_array_equal(_nearest_index(coords[::-1], values), [3, 3, 2, 2, 0, 0])
+
+
+def test_line_cross_section_reuses_unchanged_sections():
+    verts = pd.DataFrame([[0, 0, 0], [1, 0, 1], [1, 1, 2], [0, 1, 1], [0.5, 0.5, 1]],
+                         columns=['x', 'y', 'z'])
+    tris = pd.DataFrame([[0, 1, 4], [1, 2, 4], [2, 3, 4], [3, 0, 4]],
+                        columns=['v0', 'v1', 'v2'])
+    trimesh = gv.TriMesh((tris, gv.Points(verts, vdims=['z'])))
+    paths = [[(0.1, 0.1), (0.9, 0.9)], [(0.1, 0.9), (0.9, 0.1)], [(0.2, 0.5), (0.8, 0.5)]]
+    section = LineCrossSection(trimesh, paths=paths, sampling='interpolate', resolution=0.1)
+
+    first = section._sample(trimesh, {})
+    second = section._sample(trimesh, {})
+    assert all(first[i] is second[i] for i in range(3))
+    np.testing.assert_allclose(first[2].dimension_values('z'),
+                               first[2].dimension_values('x') + first[2].dimension_values('y'))
+
+    section.resolution = 0.05
+    third = section._sample(trimesh, {})
+    assert third[0] is not first[0]
+
+
+def test_surface_cross_section_reuses_rasters(monkeypatch):
+    coords = np.linspace(0.5, 9.5, 10)
+    frames = hv.HoloMap({t: hv.Image((coords, coords, np.full((10, 10), float(t))))
+                         for t in range(3)}, kdims='Time')
+    calls, original = [], analysis.rasterize
+    def rasterize(obj, **kwargs):
+        calls.append(obj)
+        return original(obj, **kwargs)
+    section = SurfaceCrossSection(frames, paths=[[(1, 1), (9, 9)]], resolution=1)
+    monkeypatch.setattr(analysis, 'rasterize', rasterize)
+
+    first = section._sample(frames.last, {})
+    second = section._sample(frames.last, {})
+    assert len(calls) == 3
+    np.testing.assert_array_equal(first.dimension_values(2), second.dimension_values(2))
+    np.testing.assert_array_equal(first.dimension_values(2, flat=False)[:, 0], [0, 1, 2])
+
+    # Editing the path reuses the stack, masking samples beyond the grid
+    section.path = gv.Path([[(1, 9), (5, 5), (12, 5)]])
+    moved = section._sample(frames.last, {})
+    assert len(calls) == 3
+    values = moved.dimension_values(2, flat=False)
+    assert np.isnan(values[:, -1]).all()
+    np.testing.assert_array_equal(values[:, 0], [0, 1, 2])
+
+
+def test_surface_cross_section_interpolate():
+    verts = pd.DataFrame([[0, 0], [1, 0], [1, 1], [0, 1]], columns=['x', 'y'])
+    tris = pd.DataFrame([[0, 1, 2], [0, 2, 3]], columns=['v0', 'v1', 'v2'])
+    frames = hv.HoloMap({t: gv.TriMesh((tris, gv.Points(verts.assign(z=verts.x*t), vdims=['z'])))
+                         for t in range(1, 3)}, kdims='Time')
+    section = SurfaceCrossSection(frames, paths=[[(0.1, 0.5), (0.5, 0.5), (0.9, 0.5)]],
+                                  sampling='interpolate', resolution=0.1)
+    image = section._sample(frames.last, {})
+    samples = image.dimension_values(2, flat=False)
+    distance = image.dimension_values(0, expanded=False)
+    np.testing.assert_allclose(samples[0], 0.1 + distance)
+    np.testing.assert_allclose(samples[1], 2*(0.1 + distance))
@@ -0,0 +1,184 @@
+import pytest
+import numpy as np
+
+from earthsim.grabcut import (
+    StrokeMaskCache, _dilate, _downsample_labels, _fill_polygons, _pyramid_grabcut,
+    _tile_windows, _tiled_grabcut, _warm_grabcut
+)
+
+
+def synthetic_scene(h=200, w=300, seed=0):
+    """
+    Noisy image of water to the left of a wavy shoreline and land to
+    the right, with a foreground stroke on the water and a background
+    stroke on the land.
+    """
+    rs = np.random.RandomState(seed)
+    ys, xs = np.mgrid[:h, :w]
+    water = xs < w/2. + 20*np.sin(ys/15.)
+    img = np.where(water[..., None], [30, 60, 140], [60, 140, 50]) + rs.randint(-20, 20, (h, w, 3))
+    mask = np.full((h, w), 2, dtype='uint8')
+    mask[h//2-3:h//2+3, 10:60] = 1
+    mask[h//2-3:h//2+3, w-60:w-10] = 0
+    return np.clip(img, 0, 255).astype('uint8'), mask, water
+
+
+def test_tile_windows():
+    windows = list(_tile_windows((10, 0, 30, 25), 10, 5, (40, 25)))
+    assert [core for core, _ in windows] == [
+        (10, 0, 20, 10), (10, 10, 20, 20), (10, 20, 20, 25),
+        (20, 0, 30, 10), (20, 10, 30, 20), (20, 20, 30, 25)]
+    assert windows[0][1] == (5, 0, 25, 15)
+    assert windows[-1][1] == (15, 15, 35, 25)
+
+
+def test_downsample_labels_keeps_thin_strokes():
+    mask = np.full((5, 6), 2, dtype='uint8')
+    mask[0, 0] = 1
+    mask[4, 5] = 0
+    mask[1, 3], mask[0, 2] = 0, 1
+    np.testing.assert_array_equal(_downsample_labels(mask, 2),
+                                  [[1, 0, 2], [2, 2, 2], [2, 2, 0]])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_tiled_grabcut(workers):
+    pytest.importorskip('cv2')
+    img, mask, water = synthetic_scene()
+    labels = _tiled_grabcut(img, mask, 3, tile_size=64, overlap=16, margin=500, workers=workers)
+    assert ((labels % 2 == 1) == water).mean() > 0.99
+
+
+def test_dilate():
+    mask = np.zeros((5, 5), dtype=bool)
+    mask[2, 2] = True
+    np.testing.assert_array_equal(_dilate(mask, 1)[1:4, 1:4], True)
+    assert _dilate(mask, 1).sum() == 9
+    assert _dilate(mask, 2).all()
+
+
+def test_pyramid_grabcut():
+    pytest.importorskip('cv2')
+    img, _, water = synthetic_scene(400, 600)
+    mask = np.full(water.shape, 2, dtype='uint8')
+    mask[195:205, 20:250] = 1
+    mask[195:205, 400:580] = 0
+    labels = _pyramid_grabcut(img, mask, 3, levels=3, tile_size=64, overlap=16)
+    assert ((labels % 2 == 1) == water).mean() > 0.99
+
+
+def test_warm_grabcut_resumes_from_state():
+    pytest.importorskip('cv2')
+    img, mask, water = synthetic_scene()
+    state = {}
+    labels, _ = _warm_grabcut(img, mask, 3, state=state)
+    assert state[('image', img.shape)][0] is labels
+
+    # Without any strokes GrabCut can only proceed by resuming from the
+    # stored labels and models
+    mask[:] = 2
+    fresh, _ = _warm_grabcut(img, mask, 3)
+    assert (fresh == 2).all()
+    resumed, _ = _warm_grabcut(img, mask, 3, refine_iterations=1, state=state)
+    assert ((resumed % 2 == 1) == water).mean() > 0.99
+
+    # Strokes added since the previous run are kept
+    mask[20:25, 10:40] = 1
+    resumed, _ = _warm_grabcut(img, mask, 3, refine_iterations=1, state=state)
+    assert (resumed[20:25, 10:40] == 1).all()
+
+
+def test_tiled_grabcut_state_keyed_on_crop():
+    pytest.importorskip('cv2')
+    img, mask, water = synthetic_scene()
+    state = {}
+    _tiled_grabcut(img, mask, 3, tile_size=64, overlap=16, margin=20, state=state)
+
+    # Moving the strokes yields a crop of the same shape at another offset
+    moved = np.roll(mask, 40, axis=0)
+    labels = _tiled_grabcut(img, moved, 3, tile_size=64, overlap=16, margin=20, state=state)
+    bounds = sorted(key[0][1] for key in state)
+    assert len(bounds) == 2 and bounds[0][0] + 40 == bounds[1][0]
+    rows = slice(bounds[1][0], bounds[1][2])
+    assert ((labels[rows] % 2 == 1) == water[rows]).mean() > 0.99
+
+
+def draw_pil(polygons, shape):
+    Image = pytest.importorskip('PIL.Image')
+    ImageDraw = pytest.importorskip('PIL.ImageDraw')
+    img = Image.new('L', shape[::-1], 0)
+    draw = ImageDraw.Draw(img)
+    for rings in polygons:
+        draw.polygon(list(zip(*rings[0].T)), outline=1, fill=1)
+    return np.array(img).astype('bool')
+
+
+def test_fill_polygons_matches_pil():
+    rs = np.random.RandomState(0)
+    for _ in range(50):
+        polygons = [[rs.uniform(-5, 45, (rs.randint(2, 12), 2))] for _ in range(3)]
+        polygons.append([rs.randint(0, 40, (6, 2)).astype(float)])
+        np.testing.assert_array_equal(_fill_polygons(polygons, (30, 40)),
+                                      draw_pil(polygons, (30, 40)))
+
+
+@pytest.mark.parametrize('ring', [
+    [[1, 2.2], [9, 2.2], [9, 2.8], [1, 2.8]],
+    [[2.2, 1], [2.8, 1], [2.8, 15], [2.2, 15]],
+    [[0, 0], [9, 0], [9, 9], [0, 9]],
+    [[3.5, 4.5], [12.5, 4.5], [12.5, 11.5], [3.5, 11.5]],
+    [[5, 1.1], [5.6, 17.9], [6.1, 1.3]]
+])
+def test_fill_polygons_matches_pil_slivers_and_squares(ring):
+    polygons = [[np.array(ring)]]
+    np.testing.assert_array_equal(_fill_polygons(polygons, (20, 20)), draw_pil(polygons, (20, 20)))
+
+
+def test_fill_polygons_matches_pil_blobs():
+    angles = np.linspace(0, 2*np.pi, 200, endpoint=False)
+    rs = np.random.RandomState(1)
+    for _ in range(5):
+        radius = 100 + 10*np.sin(3*angles + rs.uniform(0, 2*np.pi))
+        ring = np.column_stack([120.3 + radius*np.cos(angles), 115.7 + radius*np.sin(angles)])
+        polygons = [[ring]]
+        np.testing.assert_array_equal(_fill_polygons(polygons, (240, 250)),
+                                      draw_pil(polygons, (240, 250)))
+
+
+def test_fill_polygons_holes_and_overlaps():
+    square = np.array([[0, 0], [10, 0], [10, 10], [0, 10.]])
+    hole = np.array([[3, 3], [7, 3], [7, 7], [3, 7.]])
+    mask = _fill_polygons([[square, hole], [square + 8]], (20, 20))
+    assert not mask[4:7, 4:7].any()
+    assert mask[:11, :11].sum() == 121 - 9
+    assert mask[8:19, 8:19].all()
+    assert mask.sum() == 2*121 - 9 - 9
+    assert not _fill_polygons([], (5, 5)).any()
+
+
+def test_stroke_mask_cache_incremental():
+    strokes = [('a', np.array([[0, 0], [4, 0], [4, 4.]])),
+               ('b', np.array([[10, 10], [15, 10], [15, 15.]])),
+               ('c', np.array([[0, 12], [6, 12], [6, 18.]]))]
+    calls = []
+    def rasterize(polys):
+        calls.append(len(polys))
+        return _fill_polygons([[p] for p in polys], (20, 20))
+
+    cache = StrokeMaskCache()
+    mask = cache.mask('fg', (0, 0, 1, 1), (20, 20), strokes[:2], rasterize)
+    assert calls == [2]
+    assert cache.mask('fg', (0, 0, 1, 1), (20, 20), strokes[:2], rasterize) is mask
+
+    # Added strokes are rasterized on their own
+    full = _fill_polygons([[p] for _, p in strokes], (20, 20))
+    np.testing.assert_array_equal(cache.mask('fg', (0, 0, 1, 1), (20, 20), strokes, rasterize), full)
+    assert calls == [2, 1]
+
+    # Removing a stroke or changing the grid rasterizes all strokes
+    mask = cache.mask('fg', (0, 0, 1, 1), (20, 20), strokes[1:], rasterize)
+    assert not mask[:5, :5].any()
+    cache.mask('fg', (0, 0, 2, 2), (20, 20), strokes[1:], rasterize)
+    assert calls == [2, 1, 2, 2]
+    assert not cache.mask('bg', (0, 0, 1, 1), (20, 20), [], rasterize).any()
+    assert calls == [2, 1, 2, 2]
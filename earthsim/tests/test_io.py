@@ -0,0 +1,374 @@
+import os
+
+import pytest
+import numpy as np
+
+from earthsim.io import (
+    open_gssha, read_3dm_mesh, read_mesh2d, read_ugrid, write_3dm_mesh,
+    write_ugrid, disk_cache
+)
+from earthsim.mesh import remap_nodes
+
+
+sample_grid = np.array([
+    [1.5,   2.0,  3.25, 4.0],
+    [5.0, -9999,  7.0,  8.5],
+    [9.0,  10.0, 11.0, 12.0]
+])
+
+sample_3dm = """MESH2D
+MESHNAME "sample"
+E3T 1 1 2 3 1
+e4q 2 2 4 6 3 1
+E6T 3 3 7 4 8 5 9 2
+ND 1 0.0 0.0 1.0
+ND 2 10.0 0.0 2.0
+ND 3 0.0 10.0 3.0
+ND\t4 10.0 10.0 4.0
+ND 5 5.0 20.0 5.0
+ND 6 15.0 10.0 0.0
+nd 7 5.0 5.0 0.0
+ND 8 7.5 15.0 0.0
+ND 9 2.5 15.0 0.0
+NS 1 2 3
+NS -4
+NS 5 -6
+"""
+
+sample_dat = """DATASET
+OBJTYPE "mesh2d"
+BEGVEC
+ND 3
+NC 2
+NAME "Velocity"
+TIMEUNITS SECONDS
+TS 1 0.0
+1
+0
+1.0 2.0 0.0
+2.0 3.0 0.0
+3.0 4.0 0.0
+TS 0 5.5
+1.5 2.0 0.0
+2.5 3.0 0.0
+3.5 4.0 0.0
+ENDDS
+"""
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir):
+    directory = disk_cache.directory
+    disk_cache.directory = str(tmpdir.join('cache'))
+    yield disk_cache.directory
+    disk_cache.directory = directory
+
+
+def write_fgd(path, grid, nanval=-9999):
+    with open(path, 'w') as f:
+        f.write('ncols %d\nnrows %d\n' % (grid.shape[1], grid.shape[0]))
+        f.write('xllcorner 100.0\nyllcorner 200.0\ncellsize 10\n')
+        f.write('NODATA_value %d\n' % nanval)
+        for row in grid:
+            f.write(' '.join(map(str, row)) + ' \n')
+
+
+def test_open_gssha_fgd(tmpdir):
+    path = str(tmpdir.join('grid.fgd'))
+    write_fgd(path, sample_grid)
+    grid = open_gssha(path, chunks=2)
+
+    expected = np.where(sample_grid == -9999, np.nan, sample_grid)[::-1]
+    np.testing.assert_array_equal(grid.values, expected)
+    np.testing.assert_allclose(grid.x.values, [105, 115, 125, 135])
+    np.testing.assert_allclose(grid.y.values, [205, 215, 225])
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_open_gssha_integer_grid(tmpdir, cache_dir, cache):
+    path = str(tmpdir.join('grid.idx'))
+    with open(path, 'w') as f:
+        f.write('north: 30\nsouth: 0\neast: 40\nwest: 0\nrows: 3\ncols: 4\n')
+        f.write('0 1 1 2\n3 -1 0 0\n1 1 2 2\n')
+    grid = open_gssha(path, cache=cache)
+    assert grid.dtype == np.int64
+    np.testing.assert_array_equal(grid.values, [[1, 1, 2, 2], [3, -1, 0, 0], [0, 1, 1, 2]])
+
+    with open(path) as f:
+        text = f.read().replace('-1', '-1.5')
+    with open(path, 'w') as f:
+        f.write(text)
+    assert open_gssha(path, cache=cache).dtype == np.float64
+
+
+def test_open_gssha_lazy_rows(tmpdir):
+    path = str(tmpdir.join('grid.fgd'))
+    write_fgd(path, sample_grid)
+    grid = open_gssha(path, chunks=1)
+    assert grid.data.chunks[0] == (1, 1, 1)
+    np.testing.assert_array_equal(grid.isel(y=0).values, sample_grid[-1])
+
+
+def test_open_gssha_cached(tmpdir, cache_dir):
+    path = str(tmpdir.join('grid.fgd'))
+    write_fgd(path, sample_grid)
+    grid = open_gssha(path, cache=True)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Cached entry is used even if the text is no longer parseable
+    stat = os.stat(path)
+    with open(path, 'r+') as f:
+        f.seek(stat.st_size-8)
+        f.write('garbage\n')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    cached = open_gssha(path, cache=True)
+    np.testing.assert_array_equal(cached.values, grid.values)
+    np.testing.assert_array_equal(cached.y.values, grid.y.values)
+
+
+def test_open_gssha_cache_disabled(tmpdir, cache_dir):
+    path = str(tmpdir.join('grid.fgd'))
+    write_fgd(path, sample_grid)
+    open_gssha(path, cache=False)
+    open_gssha(path)
+    assert not os.path.isdir(cache_dir)
+
+
+def test_disk_cache_key_versioned(tmpdir, cache_dir):
+    path = str(tmpdir.join('grid.fgd'))
+    write_fgd(path, sample_grid)
+    key = disk_cache.key(path, reader='gssha')
+    version = disk_cache.version
+    disk_cache.version = version + 1
+    try:
+        assert disk_cache.key(path, reader='gssha') != key
+    finally:
+        disk_cache.version = version
+
+
+def test_disk_cache_eviction(cache_dir):
+    max_size = disk_cache.max_size
+    disk_cache.max_size = 1000
+    try:
+        for i in range(3):
+            disk_cache.put('entry%d' % i, {'data': np.zeros(100)})
+    finally:
+        disk_cache.max_size = max_size
+    assert disk_cache.get('entry0') is None
+    assert disk_cache.get('entry1') is None
+    np.testing.assert_array_equal(disk_cache.get('entry2')[0]['data'], np.zeros(100))
+
+
+def test_read_3dm_mesh(tmpdir):
+    path = str(tmpdir.join('mesh.3dm'))
+    with open(path, 'w') as f:
+        f.write(sample_3dm)
+    tris, verts, nodestrings = read_3dm_mesh(path, nodestrings=True, cache=True)
+
+    np.testing.assert_array_equal(tris[['v0', 'v1', 'v2']].values,
+                                  [[0, 1, 2], [1, 3, 5], [1, 5, 2], [2, 3, 4]])
+    np.testing.assert_array_equal(tris['mat'].values, [0, 0, 0, 1])
+    assert len(verts) == 9
+    np.testing.assert_array_equal(verts.iloc[3].values, [10, 10, 4])
+    np.testing.assert_array_equal(verts.iloc[6].values, [5, 5, 0])
+    assert len(nodestrings) == 2
+    np.testing.assert_array_equal(nodestrings[0], [0, 1, 2, 3])
+    np.testing.assert_array_equal(nodestrings[1], [4, 5])
+
+    # Ensure cached mesh matches
+    cached_tris, cached_verts = read_3dm_mesh(path, cache=True)
+    np.testing.assert_array_equal(cached_tris.values, tris.values)
+    np.testing.assert_array_equal(cached_verts.values, verts.values)
+
+
+def test_read_3dm_mesh_indented_cards(tmpdir):
+    path = str(tmpdir.join('mesh.3dm'))
+    with open(path, 'w') as f:
+        f.write('MESH2D\n  E3T 1 1 2 3 1\n\tE3T 2 2 4 3 1\n ND 1 0 0 1\nND 2 1 0 2\n'
+                '  ND 3 0 1 3\n\t ND 4 1 1 4\n   \n  NS 1 -4\n')
+    tris, verts, nodestrings = read_3dm_mesh(path, cache=False, nodestrings=True)
+    np.testing.assert_array_equal(tris.values, [[0, 1, 2, 0], [1, 3, 2, 0]])
+    np.testing.assert_array_equal(verts.z.values, [1, 2, 3, 4])
+    np.testing.assert_array_equal(nodestrings[0], [0, 3])
+
+
+def test_read_3dm_mesh_region(tmpdir):
+    path = str(tmpdir.join('mesh.3dm'))
+    with open(path, 'w') as f:
+        f.write(sample_3dm)
+    tris, verts, nodestrings = read_3dm_mesh(path, nodestrings=True, region=(11, 0, 20, 12))
+
+    np.testing.assert_array_equal(tris.values, [[0, 2, 3, 0], [0, 3, 1, 0]])
+    np.testing.assert_array_equal(verts.index, [1, 2, 3, 5])
+    np.testing.assert_array_equal(verts.iloc[3].values, [15, 10, 0])
+    np.testing.assert_array_equal(nodestrings[0], [0, 1, 2])
+    np.testing.assert_array_equal(nodestrings[1], [3])
+
+
+def test_read_3dm_mesh_region_splits_nodestrings(tmpdir):
+    path = str(tmpdir.join('mesh.3dm'))
+    with open(path, 'w') as f:
+        f.write('MESH2D\nE3T 1 1 2 3 1\nE3T 2 4 5 6 1\nND 1 0 0 0\nND 2 1 0 0\n'
+                'ND 3 0 1 0\nND 4 10 0 0\nND 5 11 0 0\nND 6 10 1 0\nNS 1 4 -2\n')
+    tris, verts, nodestrings = read_3dm_mesh(path, nodestrings=True, region=(-1, -1, 2, 2))
+    np.testing.assert_array_equal(verts.index, [0, 1, 2])
+    assert [s.tolist() for s in nodestrings] == [[0], [1]]
+
+
+def test_write_3dm_mesh_round_trip(tmpdir):
+    path = str(tmpdir.join('mesh.3dm'))
+    with open(path, 'w') as f:
+        f.write(sample_3dm)
+    tris, verts, nodestrings = read_3dm_mesh(path, nodestrings=True)
+
+    out = str(tmpdir.join('out.3dm'))
+    write_3dm_mesh(out, tris, verts, nodestrings=nodestrings, name='sample', chunksize=3)
+    with open(out) as f:
+        lines = f.read().splitlines()
+    assert lines[:3] == ['MESH2D', 'MESHNAME "sample"', 'E3T 1 1 2 3 1']
+    assert lines[-2:] == ['NS 1 2 3 -4', 'NS 5 -6']
+
+    written_tris, written_verts, written_strings = read_3dm_mesh(out, cache=False, nodestrings=True)
+    np.testing.assert_array_equal(written_tris.values, tris.values)
+    np.testing.assert_array_equal(written_verts.values, verts.values)
+    for written, original in zip(written_strings, nodestrings):
+        np.testing.assert_array_equal(written, original)
+
+
+def test_write_3dm_mesh_default_material(tmpdir):
+    out = str(tmpdir.join('out.3dm'))
+    write_3dm_mesh(out, np.array([[0, 1, 2]]), np.array([[0, 0], [1, 0], [0, 1.]]))
+    with open(out) as f:
+        assert f.read() == ('MESH2D\nE3T 1 1 2 3 1\nND 1 0.000000 0.000000 0.000000\n'
+                            'ND 2 1.000000 0.000000 0.000000\nND 3 0.000000 1.000000 0.000000\n')
+
+
+def test_write_3dm_mesh_skips_empty_nodestrings(tmpdir):
+    out = str(tmpdir.join('out.3dm'))
+    write_3dm_mesh(out, np.array([[0, 1, 2]]), np.array([[0, 0], [1, 0], [0, 1.]]),
+                   nodestrings=[[], [0, 1], np.array([], dtype=int)])
+    with open(out) as f:
+        assert f.read().splitlines()[-1:] == ['NS 1 -2']
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_read_mesh2d(tmpdir, cache):
+    path = str(tmpdir.join('results.dat'))
+    with open(path, 'w') as f:
+        f.write(sample_dat)
+    dfs = read_mesh2d(path, cache=cache)
+
+    assert list(dfs) == [0, 5.5]
+    assert list(dfs[0].columns) == ['Velocity_0', 'Velocity_1', 'Velocity_2']
+    np.testing.assert_array_equal(dfs[0].values, [[1, 2, 0], [2, 3, 0], [3, 4, 0]])
+    np.testing.assert_array_equal(dfs[5.5].values, [[1.5, 2, 0], [2.5, 3, 0], [3.5, 4, 0]])
+
+
+def test_read_mesh2d_lazy_by_default(tmpdir, cache_dir):
+    path = str(tmpdir.join('results.dat'))
+    with open(path, 'w') as f:
+        f.write(sample_dat)
+    dfs = read_mesh2d(path)
+    assert dfs._data is None
+    assert not os.path.isdir(cache_dir)
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_read_mesh2d_nodes(tmpdir, cache):
+    path = str(tmpdir.join('results.dat'))
+    with open(path, 'w') as f:
+        f.write(sample_dat)
+    dfs = read_mesh2d(path, cache=cache, nodes=[2, 0])
+    np.testing.assert_array_equal(dfs[5.5].values, [[3.5, 4, 0], [1.5, 2, 0]])
+
+    arr = read_mesh2d(path, cache=cache, chunks=1, nodes=[2, 0])
+    assert arr.shape == (2, 2, 3)
+    np.testing.assert_array_equal(arr[:, :, 0].compute(), [[3, 1], [3.5, 1.5]])
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_read_mesh2d_dask(tmpdir, cache):
+    path = str(tmpdir.join('results.dat'))
+    with open(path, 'w') as f:
+        f.write(sample_dat)
+    arr = read_mesh2d(path, cache=cache, chunks=1)
+
+    assert arr.shape == (2, 3, 3)
+    assert arr.chunks[0] == (1, 1)
+    np.testing.assert_array_equal(arr[:, :, 0].compute(), [[1, 2, 3], [1.5, 2.5, 3.5]])
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_remap_nodes_mesh2d_lazy(tmpdir, cache):
+    path = str(tmpdir.join('results.dat'))
+    with open(path, 'w') as f:
+        f.write(sample_dat)
+    dfs = read_mesh2d(path, cache=cache, nodes=[2, 0, 1])
+    remapped = remap_nodes(dfs, [1, 2, 0])
+    assert isinstance(remapped, type(dfs)) and remapped.nodes == 3
+    assert remapped._data is dfs._data
+    np.testing.assert_array_equal(remapped[5.5].values, [[1.5, 2, 0], [2.5, 3, 0], [3.5, 4, 0]])
+    np.testing.assert_array_equal(remapped.to_dask()[:, :, 0].compute(), [[1, 2, 3], [1.5, 2.5, 3.5]])
+
+
+def test_ugrid_round_trip(tmpdir):
+    mesh_path = str(tmpdir.join('mesh.3dm'))
+    with open(mesh_path, 'w') as f:
+        f.write(sample_3dm)
+    tris, verts = read_3dm_mesh(mesh_path)
+    path = str(tmpdir.join('mesh.nc'))
+    write_ugrid(path, tris, verts)
+    ugrid_tris, ugrid_verts, results = read_ugrid(path)
+
+    np.testing.assert_array_equal(ugrid_tris.values, tris.values)
+    np.testing.assert_array_equal(ugrid_verts.values, verts.values)
+    assert not results.data_vars
+
+
+def test_ugrid_results_subset(tmpdir):
+    dat_path = str(tmpdir.join('results.dat'))
+    with open(dat_path, 'w') as f:
+        f.write(sample_dat)
+    dataset = read_mesh2d(dat_path, cache=False)
+    tris = np.array([[0, 1, 2, 0]])
+    verts = np.array([[0, 0, 1], [10, 0, 2], [0, 10, 3.]])
+    path = str(tmpdir.join('results.nc'))
+    write_ugrid(path, tris, verts, results=dataset, chunks=2)
+
+    _, _, results = read_ugrid(path, times=[5.5], chunks=1)
+    assert list(results.data_vars) == ['Velocity_0', 'Velocity_1', 'Velocity_2']
+    np.testing.assert_array_equal(results['Velocity_0'].values, [[1.5, 2.5, 3.5]])
+
+    sub_tris, sub_verts, results = read_ugrid(path, region=(20, 20, 30, 30))
+    assert len(sub_tris) == 0 and len(sub_verts) == 0
+    assert results.sizes['node'] == 0
+
+
+def test_write_ugrid_duplicate_columns(tmpdir):
+    dat_path = str(tmpdir.join('results.dat'))
+    with open(dat_path, 'w') as f:
+        f.write(sample_dat)
+    dataset = read_mesh2d(dat_path, cache=False)
+    verts = np.array([[0, 0, 1], [10, 0, 2], [0, 10, 3.]])
+    path = str(tmpdir.join('results.nc'))
+    with pytest.raises(ValueError, match='Velocity_0'):
+        write_ugrid(path, np.array([[0, 1, 2]]), verts, results=[dataset, dataset])
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_read_mesh2d_dask_no_timesteps(tmpdir, cache):
+    path = str(tmpdir.join('results.dat'))
+    with open(path, 'w') as f:
+        f.write('DATASET\nOBJTYPE "mesh2d"\nBEGSCL\nND 3\nNC 2\nNAME "Depth"\nENDDS\n')
+    arr = read_mesh2d(path, cache=cache, chunks=2)
+    assert arr.shape == (0, 3) and arr.dtype == np.float64
+    assert arr.compute().shape == (0, 3)
+
+
+def test_read_mesh2d_dask_processes(tmpdir, cache_dir):
+    path = str(tmpdir.join('results.dat'))
+    with open(path, 'w') as f:
+        f.write(sample_dat)
+    arr = read_mesh2d(path, chunks=1)
+    np.testing.assert_array_equal(arr[:, :, 0].compute(scheduler='processes'),
+                                  [[1, 2, 3], [1.5, 2.5, 3.5]])
+    assert not os.path.isdir(cache_dir)
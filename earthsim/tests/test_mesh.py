@@ -0,0 +1,120 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from shapely.geometry import Polygon
+
+from earthsim.mesh import (
+    TriangleIndex, triangle_index, renumber_mesh, remap_nodes, subset_mesh
+)
+
+
+# Unit square split into four triangles around a center node
+sample_verts = np.array([[0, 0], [1, 0], [1, 1], [0, 1], [0.5, 0.5]], dtype=float)
+sample_tris = np.array([[0, 1, 4], [1, 2, 4], [2, 3, 4], [3, 0, 4]])
+
+
+def test_triangle_index_query():
+    index = TriangleIndex(sample_verts, sample_tris)
+    tri_ids, weights = index.query([0.5, 0.9, 0.1, 2.0], [0.1, 0.5, 0.5, 0.5])
+    np.testing.assert_array_equal(tri_ids, [0, 1, 3, -1])
+    np.testing.assert_allclose(weights.sum(axis=1)[:3], 1)
+    assert np.isnan(weights[3]).all()
+
+
+def test_triangle_index_interpolate_linear_field():
+    index = TriangleIndex(sample_verts, sample_tris)
+    values = 2*sample_verts[:, 0] + 3*sample_verts[:, 1]
+    xs, ys = np.random.RandomState(1).rand(2, 100)
+    np.testing.assert_allclose(index.interpolate(values, xs, ys), 2*xs + 3*ys)
+
+
+def test_triangle_index_interpolate_multiple_values():
+    index = TriangleIndex(sample_verts, sample_tris)
+    values = np.column_stack([sample_verts[:, 0], -sample_verts[:, 1]])
+    samples = index.interpolate(values, [0.25, 5], [0.75, 5])
+    np.testing.assert_allclose(samples[0], [0.25, -0.75])
+    assert np.isnan(samples[1]).all()
+
+
+def test_triangle_index_cached_until_modified():
+    tris = pd.DataFrame(sample_tris, columns=['v0', 'v1', 'v2'])
+    verts = pd.DataFrame(sample_verts, columns=['x', 'y'])
+    index = triangle_index(tris, verts)
+    assert triangle_index(tris.copy(), verts.copy()) is index
+    verts.loc[4, 'x'] = 0.6
+    assert triangle_index(tris, verts) is not index
+
+
+def shuffled_grid(n, seed=1):
+    xs, ys = np.meshgrid(np.arange(n, dtype=float), np.arange(n, dtype=float))
+    idx = np.arange(n*n).reshape(n, n)
+    v0, v1, v2, v3 = idx[:-1, :-1], idx[:-1, 1:], idx[1:, 1:], idx[1:, :-1]
+    tris = np.concatenate([np.column_stack([v0.ravel(), v1.ravel(), v2.ravel()]),
+                           np.column_stack([v0.ravel(), v2.ravel(), v3.ravel()])])
+    perm = np.random.RandomState(seed).permutation(n*n)
+    inverse = np.argsort(perm)
+    verts = pd.DataFrame({'x': xs.ravel()[perm], 'y': ys.ravel()[perm]}, columns=['x', 'y'])
+    tris = pd.DataFrame(inverse[tris], columns=['v0', 'v1', 'v2'])
+    tris['mat'] = np.arange(len(tris)) % 3
+    return tris, verts
+
+
+def bandwidth(tris):
+    conns = tris[['v0', 'v1', 'v2']].values
+    return (conns.max(axis=1) - conns.min(axis=1)).mean()
+
+
+@pytest.mark.parametrize('method', ['rcm', 'hilbert'])
+def test_renumber_mesh(method):
+    tris, verts = shuffled_grid(20)
+    new_tris, new_verts, order = renumber_mesh(tris, verts, method=method)
+    assert list(new_tris.columns) == ['v0', 'v1', 'v2', 'mat']
+    assert bandwidth(new_tris) < bandwidth(tris)/4
+
+    # Elements refer to the same coordinates and materials
+    old = verts.values[tris[['v0', 'v1', 'v2']].values]
+    new = new_verts.values[new_tris[['v0', 'v1', 'v2']].values]
+    old_keys = sorted(map(tuple, np.column_stack([old.reshape(len(old), -1), tris['mat']])))
+    new_keys = sorted(map(tuple, np.column_stack([new.reshape(len(new), -1), new_tris['mat']])))
+    assert old_keys == new_keys
+
+
+def test_remap_nodes():
+    tris, verts = shuffled_grid(5)
+    _, new_verts, order = renumber_mesh(tris, verts, method='hilbert')
+    results = np.stack([verts.x.values, verts.x.values*2])
+    remapped = remap_nodes(results, order, axis=1)
+    np.testing.assert_array_equal(remapped[1], new_verts.x.values*2)
+    mapping = remap_nodes({0: verts}, order)
+    np.testing.assert_array_equal(mapping[0].values, new_verts.values)
+
+
+def test_subset_mesh_polygon():
+    # Polygon inside the bottom triangle without containing any node
+    region = Polygon([(0.4, 0.1), (0.6, 0.1), (0.5, 0.2)])
+    tris, verts, nodes = subset_mesh(sample_tris, sample_verts, region)
+    np.testing.assert_array_equal(tris, [[0, 1, 2]])
+    np.testing.assert_array_equal(nodes, [0, 1, 4])
+    np.testing.assert_array_equal(verts, sample_verts[[0, 1, 4]])
+
+    # Polygon containing the right-hand node
+    region = Polygon([(0.9, 0.9), (1.1, 0.9), (1.1, 1.1), (0.9, 1.1)])
+    tris, _, nodes = subset_mesh(sample_tris, sample_verts, region)
+    np.testing.assert_array_equal(nodes, [1, 2, 3, 4])
+    assert len(tris) == 2
+
+
+def test_subset_mesh_polygon_crossing_element():
+    # Thin strip crossing the lower triangles without a node or
+    # polygon vertex inside any of them
+    region = Polygon([(-1, 0.05), (2, 0.05), (2, 0.08), (-1, 0.08)])
+    tris, _, nodes = subset_mesh(sample_tris, sample_verts, region)
+    assert len(tris) == 3
+    np.testing.assert_array_equal(nodes, [0, 1, 2, 3, 4])
+    assert not any(set(tri) == {2, 3, 4} for tri in tris.tolist())
+
+
+def test_subset_mesh_bbox():
+    tris, verts, nodes = subset_mesh(sample_tris, sample_verts, (2, 2, 3, 3))
+    assert len(tris) == 0 and len(verts) == 0 and len(nodes) == 0
@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from earthsim.quality import mesh_quality, node_valence
+
+
+verts = pd.DataFrame([(0, 0, 0), (2, 0, 0), (1, np.sqrt(3), 0), (0, 2, 0), (4, 0, 0)],
+                     columns=['x', 'y', 'z'])
+cells = pd.DataFrame([(0, 1, 2), (0, 2, 3), (0, 1, 4)], columns=['v0', 'v1', 'v2'])
+
+
+def test_mesh_quality_equilateral():
+    quality = mesh_quality(verts, cells)
+    assert list(quality.columns[:3]) == ['v0', 'v1', 'v2']
+    equilateral = quality.iloc[0]
+    np.testing.assert_allclose(equilateral['area'], np.sqrt(3))
+    np.testing.assert_allclose(equilateral[['edge0', 'edge1', 'edge2']].values, 2)
+    np.testing.assert_allclose(equilateral[['min_angle', 'max_angle']].values, 60)
+    np.testing.assert_allclose(equilateral['aspect_ratio'], 1)
+
+
+def test_mesh_quality_sliver_and_degenerate():
+    quality = mesh_quality(verts, cells)
+    np.testing.assert_allclose(quality['min_angle'][1], 30)
+    np.testing.assert_allclose(quality['max_angle'][1], 75)
+    assert quality['aspect_ratio'][1] > 1
+    assert quality['area'][2] == 0
+    assert quality['aspect_ratio'][2] == np.inf
+
+
+def test_node_valence():
+    valence = node_valence(verts, cells)
+    np.testing.assert_array_equal(valence.values, [4, 3, 3, 2, 2])
+
+
+def test_swapped_arguments_raise():
+    for func in (mesh_quality, node_valence):
+        with pytest.raises(ValueError, match='swapped'):
+            func(cells, verts)
+        with pytest.raises(ValueError, match='not among the 3 verts'):
+            func(cells.values, verts.values)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from earthsim.xmsmesh import (
+    GenerateMesh, xmsmesh_to_dataframe, size_from_gradient, _polygon_groups,
+    _raster_size, _size_function, _stitch_meshes
+)
+
+
+sample_pts = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (2, 0, 0), (2, 1, 0)]
+
+
+def test_xmsmesh_to_dataframe_triangles():
+    cells = [5, 3, 0, 1, 2, 5, 3, 0, 2, 3]
+    pts, tris = xmsmesh_to_dataframe(sample_pts, cells)
+    assert list(pts.columns) == ['x', 'y', 'z']
+    assert len(pts) == 6
+    np.testing.assert_array_equal(tris.values, [[0, 1, 2], [0, 2, 3]])
+
+
+def test_xmsmesh_to_dataframe_mixed_cells():
+    cells = [5, 3, 0, 1, 2, 9, 4, 1, 4, 5, 2, 5, 3, 0, 2, 3]
+    _, tris = xmsmesh_to_dataframe(sample_pts, cells)
+    np.testing.assert_array_equal(tris.values, [[0, 1, 2], [1, 4, 5], [1, 5, 2], [0, 2, 3]])
+
+
+def test_polygon_groups():
+    square = np.array([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)], dtype=float)
+    polys = [square, square+[3, 0, 0], square+[0.5, 0.5, 0], square+[6, 0, 0], square+[4, 0, 0]]
+    assert _polygon_groups(polys) == [[0, 2], [1, 4], [3]]
+
+
+def test_stitch_meshes():
+    pts = pd.DataFrame(sample_pts[:3], columns=['x', 'y', 'z'])
+    cells = pd.DataFrame([[0, 1, 2]], columns=['v0', 'v1', 'v2'])
+    other = pd.DataFrame(sample_pts[2:], columns=['x', 'y', 'z'])
+    other_cells = pd.DataFrame([[0, 1, 3], [1, 2, 3]], columns=['v0', 'v1', 'v2'])
+    stitched_pts, stitched_cells = _stitch_meshes([(pts, cells), (other, other_cells)])
+    np.testing.assert_array_equal(stitched_pts.values, np.vstack([pts.values, other.values]))
+    np.testing.assert_array_equal(stitched_cells.values, [[0, 1, 2], [3, 4, 6], [4, 5, 6]])
+    assert list(stitched_pts.index) == list(range(7))
+
+
+def test_generate_mesh_stitches_groups():
+    square = {'Longitude': [0, 1000, 1000, 0], 'Latitude': [0, 0, 1000, 1000]}
+    shifted = dict(square, Longitude=[x+5000 for x in square['Longitude']])
+    meshes = []
+    for polys in ([square], [shifted]):
+        mesher = GenerateMesh(polys=polys, node_spacing=250)
+        mesher.create_mesh()
+        meshes.append((mesher.vert_points.dframe(), mesher.cells))
+
+    mesher = GenerateMesh(polys=[square, shifted], node_spacing=250)
+    for _ in range(2):
+        # The second run stitches the cached meshes of each group
+        mesher.create_mesh()
+        pts, cells = mesher.vert_points.dframe(), mesher.cells.values
+        offset, ncells = len(meshes[0][0]), len(meshes[0][1])
+        assert len(pts) == offset + len(meshes[1][0])
+        np.testing.assert_array_equal(cells[:ncells], meshes[0][1].values)
+        np.testing.assert_array_equal(cells[ncells:], meshes[1][1].values + offset)
+        xs = pts.x.values[cells]
+        assert ((xs <= 1000).all(axis=1) | (xs >= 5000).all(axis=1)).all()
+
+
+def test_size_from_gradient():
+    xs = np.arange(5.)
+    raster = xr.DataArray(np.tile(xs**2, (3, 1)), coords=[('y', [0., 1., 2.]), ('x', xs)])
+    sizes = size_from_gradient(raster, 10, 100)
+    assert sizes.shape == (3, 5)
+    np.testing.assert_allclose(sizes.values[:, 0], 100)
+    np.testing.assert_allclose(sizes.values[:, -1], 10)
+
+
+def test_raster_size_subset():
+    raster = xr.DataArray(np.arange(20.).reshape(4, 5), coords=[('y', np.arange(4.)), ('x', np.arange(5.))])
+    raster.values[1, 1] = np.nan
+    pts, tris, sizes = _raster_size(raster, (0.5, 0.5, 1.5, 1.5), fill=-1)
+    assert len(pts) == 9
+    assert len(tris) == 3*8
+    np.testing.assert_array_equal(pts[:, 0], [0, 1, 2]*3)
+    np.testing.assert_array_equal(sizes, [0, 1, 2, 5, -1, 7, 10, 11, 12])
+
+
+def test_size_function_partial_raster():
+    # Raster covering only the left part of the polygon bounds
+    raster = xr.DataArray(np.full((3, 3), 10.), coords=[('y', np.arange(3.)), ('x', np.arange(3.))])
+    size = _raster_size(raster, (0, 0, 10, 2), fill=100)
+    interp = _size_function(size, 100)
+    assert interp.interpolate_to_point((1, 1, 0)) == 10
+    assert interp.interpolate_to_point((8, 1, 0)) == 100
@@ -1,19 +1,63 @@
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+
 import numpy as np
+import xarray as xr
 import panel as pn
 import geoviews as gv
 import cartopy.crs as ccrs
+import xmsinterp
 import xmsmesh
 import pandas as pd
+import datashader as ds
 from geoviews import opts, tile_sources as gvts
+from holoviews.operation.datashader import datashade, rasterize
 import param
 
+from shapely.geometry import Point, Polygon
+from shapely.prepared import prep
+try:
+    from shapely import STRtree
+except ImportError:
+    # Shapely < 2.0 does not support bulk spatial index queries
+    STRtree = None
+
 from earthsim.annotators import PolyAndPointAnnotator
+from earthsim.mesh import _array_hash
+
+
+def _cell_offsets(cells):
+    """
+    Returns the offsets of each cell in a flat xmsmesh cell stream of
+    the form [celltype, npts, p0, ..., celltype, npts, p0, ...]. Since
+    the offset of each cell depends on the size of all previous cells
+    the chain of offsets is followed by pointer doubling, i.e. in a
+    logarithmic number of vectorized steps.
+    """
+    n = len(cells)
+    jump = np.full(n+1, n, dtype=np.int64)
+    jump[:n-1] = np.minimum(np.arange(n-1) + 2 + cells[1:], n)
+    offsets = np.array([0], dtype=np.int64)
+    while True:
+        following = jump[offsets]
+        following = following[following < n]
+        if not len(following):
+            break
+        offsets = np.concatenate([offsets, following])
+        jump = jump[jump]
+    return np.sort(offsets)
 
 
 def xmsmesh_to_dataframe(pts, cells):
     """
     Convert mesh pts and cells to dataframe
 
+    Cells with more than three points (e.g. quadrilaterals) are split
+    into a fan of triangles.
+
     Args:
       pts (MultiPolyMesherIo.points): Points from a MultiPolyMesherIo
       cells (MultiPolyMesherIo.cells: Cells from a MultiPolyMesherIo
@@ -23,13 +67,198 @@ def xmsmesh_to_dataframe(pts, cells):
       pd.DataFrame: MultiPolyMesherIo cells in a dataframe
     """
     r_pts = pd.DataFrame(pts, columns=['x', 'y', 'z'])
-    r_cells = pd.DataFrame([(cells[ x +2], cells[ x +3], cells[ x +4]) for x in range(0, len(cells), 5)], columns=['v0', 'v1', 'v2'])
+    cells = np.asarray(cells, dtype=np.int32)
+    if len(cells) % 5 == 0 and (cells[1::5] == 3).all():
+        # Fast path for triangle only meshes
+        tris = cells.reshape(-1, 5)[:, 2:]
+    else:
+        offsets = _cell_offsets(cells)
+        ntris = cells[offsets+1] - 2
+        starts = np.repeat(offsets, ntris)
+        fan = np.arange(ntris.sum()) - np.repeat(np.cumsum(ntris)-ntris, ntris) + 1
+        tris = np.column_stack([cells[starts+2], cells[starts+2+fan], cells[starts+3+fan]])
+    r_cells = pd.DataFrame(tris, columns=['v0', 'v1', 'v2'])
     return r_pts, r_cells
 
 
+def size_from_gradient(raster, min_size, max_size):
+    """
+    Derives an element size raster from the gradient magnitude of a
+    raster, e.g. of elevation or bathymetry, assigning the min_size to
+    the steepest and the max_size to the flattest cells.
+
+    Parameters
+    ----------
+
+    raster: xr.DataArray
+        Raster with x and y coordinates
+    min_size: float
+        Element size at the largest gradient
+    max_size: float
+        Element size at the smallest gradient
+
+    Returns
+    -------
+
+    sizes: xr.DataArray
+        Raster of element sizes
+    """
+    raster = raster.transpose('y', 'x')
+    dy, dx = np.gradient(raster.values.astype(np.float64),
+                         raster.y.values, raster.x.values)
+    magnitude = np.hypot(dx, dy)
+    lo, hi = np.nanmin(magnitude), np.nanmax(magnitude)
+    scaled = (magnitude-lo)/(hi-lo) if hi > lo else np.zeros_like(magnitude)
+    return raster.copy(data=max_size-(max_size-min_size)*scaled)
+
+
+def _coarsen_raster(raster, max_points):
+    """
+    Coarsens a raster by taking the minimum of square blocks so that
+    it has at most max_points cells.
+    """
+    raster = raster.transpose('y', 'x')
+    factor = int(np.ceil(np.sqrt(raster.size/float(max_points))))
+    if factor > 1:
+        raster = raster.coarsen(x=factor, y=factor, boundary='trim').min()
+    return raster
+
+
+def _raster_size(raster, bounds, fill):
+    """
+    Returns the node coordinates, triangle connectivity and sizes of a
+    triangulation of the raster cells covering the supplied bounds,
+    with NaN sizes replaced by the fill value, or None if less than
+    two by two cells overlap the bounds.
+    """
+    (x0, y0, x1, y1) = bounds
+    xs, ys = raster.x.values, raster.y.values
+    dx = np.abs(np.diff(xs)).max() if len(xs) > 1 else 0
+    dy = np.abs(np.diff(ys)).max() if len(ys) > 1 else 0
+    xidx = np.flatnonzero((xs >= x0-dx) & (xs <= x1+dx))
+    yidx = np.flatnonzero((ys >= y0-dy) & (ys <= y1+dy))
+    if len(xidx) < 2 or len(yidx) < 2:
+        return None
+    values = raster.values[yidx[0]:yidx[-1]+1, xidx[0]:xidx[-1]+1]
+    xx, yy = np.meshgrid(xs[xidx[0]:xidx[-1]+1], ys[yidx[0]:yidx[-1]+1])
+    ny, nx = xx.shape
+    pts = np.column_stack([xx.ravel(), yy.ravel(), np.zeros(nx*ny)])
+    idx = np.arange(nx*ny).reshape(ny, nx)
+    v0, v1, v2, v3 = idx[:-1, :-1], idx[:-1, 1:], idx[1:, 1:], idx[1:, :-1]
+    tris = np.concatenate([np.column_stack([v0.ravel(), v1.ravel(), v2.ravel()]),
+                           np.column_stack([v0.ravel(), v2.ravel(), v3.ravel()])])
+    sizes = np.where(np.isnan(values), fill, values).ravel()
+    return pts, tris.ravel(), sizes
+
+
+def _size_function(size, fill):
+    """
+    Builds an xmsinterp linear interpolator from the node coordinates,
+    triangles and sizes returned by _raster_size, returning the fill
+    value for points outside the triangulated raster, e.g. where the
+    raster only partly covers a polygon.
+    """
+    pts, tris, sizes = size
+    interp = xmsinterp.interpolate.InterpLinear(pts=pts, tris=tris, scalar=sizes)
+    interp.extrapolation_value = fill
+    return interp
+
+
+def _redistribute(poly_data, node_spacing, size=None):
+    """
+    Redistributes the points along a polygon boundary to the supplied
+    node spacing or, if supplied, to the sizes interpolated from the
+    triangulated size raster.
+    """
+    # instantiate the redistribution class
+    rdp = xmsmesh.meshing.PolyRedistributePts()
+    if size is None:
+        # set the node distance
+        rdp.set_constant_size_func(node_spacing)  # create_constant_size_function
+    else:
+        rdp.set_size_func(_size_function(size, node_spacing))
+    # run the redistribution function
+    return rdp.redistribute(poly_data)
+
+
+def _polygon_groups(polys):
+    """
+    Groups the supplied polygon coordinate arrays into sets of
+    mutually overlapping or touching polygons, which have to be meshed
+    together, querying the intersecting pairs from a spatial index.
+    Returns a list of lists of polygon indexes.
+    """
+    geoms = [Polygon(p[:, :2]).buffer(0) for p in polys]
+    groups = list(range(len(geoms)))
+
+    def root(i):
+        while groups[i] != i:
+            groups[i] = groups[groups[i]]
+            i = groups[i]
+        return i
+
+    if STRtree is None:
+        pairs = ((i, j) for i, prepared in enumerate(map(prep, geoms))
+                 for j in range(i+1, len(geoms)) if prepared.intersects(geoms[j]))
+    else:
+        pairs = STRtree(geoms).query(geoms, predicate='intersects').T
+    for i, j in pairs:
+        groups[root(j)] = root(i)
+    components = OrderedDict()
+    for i in range(len(geoms)):
+        components.setdefault(root(i), []).append(i)
+    return list(components.values())
+
+
+def _stitch_meshes(meshes):
+    """
+    Concatenates the (pts, cells) dataframes of independently meshed
+    groups of polygons into a single mesh, offsetting the node
+    indexes of the cells of each group by the number of nodes in all
+    preceding groups.
+    """
+    all_pts, all_cells, offset = [], [], 0
+    for pts, cells in meshes:
+        all_pts.append(pts)
+        all_cells.append(cells + offset)
+        offset += len(pts)
+    if not all_pts:
+        return pd.DataFrame(columns=['x', 'y', 'z']), pd.DataFrame(columns=['v0', 'v1', 'v2'])
+    return pd.concat(all_pts, ignore_index=True), pd.concat(all_cells, ignore_index=True)
+
+
 class GenerateMesh(param.Parameterized):
     node_spacing = param.Number(default=1000, bounds=(0, None), softbounds=(10, 1000), label='Polygon Edge Spacing')
 
+    workers = param.Integer(default=1, bounds=(1, None), precedence=-1, doc="""
+        Number of workers used to redistribute the polygon boundaries.""")
+
+    executor = param.ObjectSelector(default='thread', objects=['thread', 'process'],
+                                    precedence=-1, doc="""
+        Whether to redistribute polygons on a pool of threads or processes.""")
+
+    incremental = param.Boolean(default=True, precedence=-1, doc="""
+        Whether to mesh disjoint polygons separately, caching the
+        redistributed boundary and mesh of each so that only polygons
+        whose geometry or refine points changed are remeshed.
+        Overlapping or touching polygons are always meshed together.""")
+
+    size_raster = param.ClassSelector(default=None, class_=xr.DataArray, precedence=-1, doc="""
+        Raster of element sizes with x and y coordinates in the same
+        coordinate system as the polygons, e.g. computed from an
+        elevation raster using size_from_gradient. If supplied it
+        drives the node spacing along the polygon boundaries and the
+        element size in their interior, with node_spacing used where
+        the raster is missing or NaN.""")
+
+    size_raster_points = param.Integer(default=250000, bounds=(4, None), precedence=-1, doc="""
+        Maximum number of raster cells to sample the element size
+        from, larger rasters are coarsened by taking the minimum size
+        of each block of cells.""")
+
+    cache_size = param.Integer(default=100, bounds=(0, None), precedence=-1, doc="""
+        Maximum number of redistributed boundaries and meshes to cache.""")
+
     vert_points = param.ClassSelector(default=gv.Points([]), class_=gv.Points, precedence=-1)
     cells = param.ClassSelector(default=pd.DataFrame(), class_=pd.DataFrame, precedence=-1)
 
@@ -37,47 +266,160 @@ class GenerateMesh(param.Parameterized):
         super(GenerateMesh, self).__init__(**params)
 
         self.annot = PolyAndPointAnnotator(polys=polys, point_columns=['Size'], points=points)
+        self.timings = OrderedDict()
+        self._boundary_cache = OrderedDict()
+        self._mesh_cache = OrderedDict()
+        self._raster = None
+        self.mesh_io = None
 
-    def create_mesh(self):
-        # Add refine points
-        points = self.annot.point_stream.element
+    def _cache(self, cache, key, value):
+        cache[key] = value
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    @contextmanager
+    def _timed(self, stage):
+        """
+        Records the time spent in a stage of the mesh generation.
+        """
+        start = time.perf_counter()
+        yield
+        self.timings[stage] = time.perf_counter() - start
+        self.param.debug('%s stage took %.3f seconds' % (stage, self.timings[stage]))
+
+    def _redistribute_polys(self, polys):
+        """
+        Redistributes the boundary of each polygon, dispatching them
+        to a pool of workers if requested and returning the results
+        in order.
+        """
+        spacings = [self.node_spacing]*len(polys)
+        sizes = [self._size(poly) for poly in polys]
+        if self.workers == 1 or len(polys) < 2:
+            return list(map(_redistribute, polys, spacings, sizes))
+        pool = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+        with pool(max_workers=self.workers) as executor:
+            return list(executor.map(_redistribute, polys, spacings, sizes))
+
+    def _size(self, *polys):
+        """
+        Returns the triangulated size raster covering the bounds of
+        the supplied polygons, or None if no size raster is in use.
+        """
+        if self._raster is None:
+            return None
+        pts = np.concatenate(polys)
+        bounds = tuple(pts[:, :2].min(axis=0)) + tuple(pts[:, :2].max(axis=0))
+        return _raster_size(self._raster, bounds, self.node_spacing)
 
-        refine_points = []
+    def _refine_points(self):
+        """
+        Returns an array of the x, y and size of each refine point,
+        skipping points without a size.
+        """
+        points = self.annot.point_stream.element
+        refine = []
         for x, y, s in zip(*(points.dimension_values(i) for i in range(3))):
             if s:
-                refine_points.append(
-                    xmsmesh.meshing.RefinePoint(create_mesh_point=True, point=(x, y, 0), size=float(s)))
-
+                refine.append((x, y, float(s)))
             else:
                 print('refine point {}, {} skipped due to missing size value'.format(x, y))
+        return np.array(refine, dtype=np.float64).reshape(-1, 3)
 
+    def _generate(self, boundaries, refine):
+        """
+        Meshes the supplied redistributed boundaries and refine
+        points returning the xmsmesh MultiPolyMesherIo.
+        """
+        # convert each polygon to an 'input polygon'
         input_polygon = []
-
-        # add each polygon to the input data
-        for ply in self.annot.poly_stream.element.split(datatype='dataframe'):
-            # add an additional dimension as zeros (for required dimensionality)
-            poly_data = np.hstack((ply[['Longitude', 'Latitude']].values, np.zeros((len(ply['Latitude']), 1))))
-            # instantiate the redistribution class
-            rdp = xmsmesh.meshing.PolyRedistributePts()
-            # set the node distance
-            rdp.set_constant_size_func(self.node_spacing)  # create_constant_size_function
-            # run the redistribution function
-            outdata = rdp.redistribute(poly_data)
-
-            # convert the polygon to an 'input polygon'
-            input_polygon.append(xmsmesh.meshing.PolyInput(outside_polygon=outdata))
+        for outdata in boundaries:
+            size = self._size(outdata)
+            if size is None:
+                input_polygon.append(xmsmesh.meshing.PolyInput(outside_polygon=outdata))
+            else:
+                input_polygon.append(xmsmesh.meshing.PolyInput(
+                    outside_polygon=outdata, size_function=_size_function(size, self.node_spacing)))
+        refine_points = [xmsmesh.meshing.RefinePoint(create_mesh_point=True, point=(x, y, 0), size=s)
+                         for x, y, s in refine]
 
         # add the input polygons as polygons to the mesher class
-        self.mesh_io = xmsmesh.meshing.MultiPolyMesherIo(poly_inputs=input_polygon, refine_points=refine_points)
+        mesh_io = xmsmesh.meshing.MultiPolyMesherIo(poly_inputs=input_polygon, refine_points=refine_points)
 
         # Generate Mesh
-        succeded, errors = xmsmesh.meshing.mesh_utils.generate_mesh(mesh_io=self.mesh_io)
+        succeded, errors = xmsmesh.meshing.mesh_utils.generate_mesh(mesh_io=mesh_io)
+        return mesh_io
+
+    def create_mesh(self):
+        # Add refine points
+        refine = self._refine_points()
+
+        # add an additional dimension as zeros (for required dimensionality)
+        polys = [np.hstack((ply[['Longitude', 'Latitude']].values, np.zeros((len(ply['Latitude']), 1))))
+                 for ply in self.annot.poly_stream.element.split(datatype='dataframe')]
 
-        # convert the xms data format into dataframes
-        pts, self.cells = xmsmesh_to_dataframe(self.mesh_io.points, self.mesh_io.cells)
+        # Coarsen the size raster once per mesh generation
+        if self.size_raster is None:
+            self._raster, raster_key = None, None
+        else:
+            self._raster = _coarsen_raster(self.size_raster, self.size_raster_points)
+            raster_key = _array_hash(self._raster.x.values, self._raster.y.values,
+                                     self._raster.values)
 
-        # convert the pts df into a hv Points class
-        self.vert_points = gv.Points(pts, vdims=['z'], crs=ccrs.GOOGLE_MERCATOR)
+        # Redistribute only the boundaries which are not cached
+        keys = [(_array_hash(poly), self.node_spacing, raster_key) for poly in polys]
+        missing = [i for i, key in enumerate(keys) if key not in self._boundary_cache]
+        with self._timed('redistribute'):
+            redistributed = self._redistribute_polys([polys[i] for i in missing])
+        boundaries = [self._boundary_cache.get(key) for key in keys]
+        for i, outdata in zip(missing, redistributed):
+            boundaries[i] = outdata
+            self._cache(self._boundary_cache, keys[i], outdata)
+
+        # Split into independently meshed groups of polygons along
+        # with the refine points they contain
+        if self.incremental:
+            groups = _polygon_groups(polys)
+        else:
+            groups = [list(range(len(polys)))]
+        group_refine = []
+        for group in groups:
+            if len(groups) == 1:
+                group_refine.append(refine)
+                continue
+            geoms = [prep(Polygon(polys[i][:, :2]).buffer(0)) for i in group]
+            inside = [any(g.intersects(Point(x, y)) for g in geoms) for x, y, _ in refine]
+            group_refine.append(refine[np.array(inside, dtype=bool)])
+        group_keys = [(tuple(keys[i] for i in group), _array_hash(r))
+                      for group, r in zip(groups, group_refine)]
+
+        with self._timed('mesh'):
+            meshes = {}
+            for group, r, key in zip(groups, group_refine, group_keys):
+                if key in meshes:
+                    continue
+                elif key in self._mesh_cache:
+                    self._mesh_cache.move_to_end(key)
+                    meshes[key] = self._mesh_cache[key]
+                else:
+                    # mesh_io holds the last MultiPolyMesherIo generated,
+                    # which only covers every polygon if they are meshed
+                    # as a single group
+                    self.mesh_io = self._generate([boundaries[i] for i in group], r)
+                    meshes[key] = self.mesh_io
+
+        with self._timed('convert'):
+            # convert the xms data format into dataframes and stitch
+            # the meshes of each group together
+            for key in group_keys:
+                if not isinstance(meshes[key], tuple):
+                    mesh_io = meshes[key]
+                    meshes[key] = xmsmesh_to_dataframe(mesh_io.points, mesh_io.cells)
+                    self._cache(self._mesh_cache, key, meshes[key])
+            pts, self.cells = _stitch_meshes([meshes[key] for key in group_keys])
+
+            # convert the pts df into a hv Points class
+            self.vert_points = gv.Points(pts, vdims=['z'], crs=ccrs.GOOGLE_MERCATOR)
 
     @param.output(('vert_points', gv.Points), ('cells', pd.DataFrame))
     def output(self):
@@ -96,15 +438,52 @@ class ViewMesh(param.Parameterized):
     vert_points = param.ClassSelector(default=gv.Points([]), class_=gv.Points, precedence=-1)
     cells = param.ClassSelector(default=pd.DataFrame(), class_=pd.DataFrame, precedence=-1)
 
+    mode = param.ObjectSelector(default='auto', objects=['auto', 'edgepaths', 'wireframe', 'filled'], doc="""
+        How to render the mesh. 'edgepaths' sends every edge to the
+        browser as a path, while 'wireframe' and 'filled' rasterize the
+        edges or the node values interpolated across each triangle
+        with datashader on the server, re-rendering whenever the
+        viewport changes. 'auto' uses edgepaths for meshes with fewer
+        than edgepath_limit elements and wireframe otherwise.""")
+
+    edgepath_limit = param.Integer(default=50000, bounds=(0, None), doc="""
+        Maximum number of elements rendered as edgepaths in 'auto' mode.""")
+
+    line_color = param.String(default='yellow', doc="""
+        Color of the mesh edges.""")
+
+    cmap = param.String(default='viridis', doc="""
+        Colormap used to render the node values in 'filled' mode.""")
+
     def __init__(self, vert_points, cells, **params):
         super(ViewMesh, self).__init__(vert_points=vert_points, cells=cells, **params)
 
     def view(self):
-        # create the trimesh for displaying unstructured grids
-        trimesh = gv.TriMesh((self.cells, self.vert_points))
+        mode = self.mode
+        if mode == 'auto':
+            mode = 'edgepaths' if len(self.cells) < self.edgepath_limit else 'wireframe'
+        plot_opts = dict(height=600, width=600)
 
-        return trimesh.edgepaths.opts(line_width=0.5, height=600, width=600, line_color='yellow') * gvts.EsriImagery
+        if mode == 'edgepaths':
+            # create the trimesh for displaying unstructured grids
+            trimesh = gv.TriMesh((self.cells, self.vert_points))
+            mesh = trimesh.edgepaths.opts(line_width=0.5, line_color=self.line_color, **plot_opts)
+        elif mode == 'wireframe':
+            # without any value dimensions the trimesh is rasterized as
+            # a wireframe
+            nodes = self.vert_points.clone(vdims=[])
+            trimesh = gv.TriMesh((self.cells, nodes))
+            mesh = datashade(trimesh, aggregator=ds.any(), cmap=[self.line_color],
+                             **plot_opts).opts(**plot_opts)
+        else:
+            if not self.vert_points.vdims:
+                raise ValueError('Rendering a filled mesh requires the vert_points '
+                                 'to declare a value dimension.')
+            trimesh = gv.TriMesh((self.cells, self.vert_points))
+            vdim = self.vert_points.vdims[0].name
+            mesh = rasterize(trimesh, aggregator=ds.mean(vdim), precompute=True, **plot_opts)
+            mesh = mesh.opts(cmap=self.cmap, colorbar=True, tools=['hover'], **plot_opts)
+        return mesh * gvts.EsriImagery
 
     def panel(self):
-        return pn.Column(self.view)
-
+        return pn.Row(pn.Column(self.view), pn.panel(self.param, parameters=['mode'], show_name=False))